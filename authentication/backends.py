@@ -3,7 +3,6 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import Group
 from django.contrib.auth.models import Permission
-from django.db.models import Q
 
 import authentication.utils as utils
 from .models import AuthUser
@@ -110,7 +109,7 @@ class MultipleGroupCategoriesBackend(ModelBackend):
         # If list of groups exist, is not None and not empty
         if hasattr(user_model, 'PERMISSION_GROUPS') and user_model.PERMISSION_GROUPS and len(
                 user_model.PERMISSION_GROUPS) != 0:
-            query = Q()
+            group_pks = set()
 
             # For all fields in the list
             for group_type_name in user_model.PERMISSION_GROUPS:
@@ -118,7 +117,7 @@ class MultipleGroupCategoriesBackend(ModelBackend):
 
                 # If group_field is an instance of Group (or subclass)
                 if isinstance(group_field, Group):
-                    query = query | Q(**{'group': group_field})
+                    group_pks.add(group_field.pk)
                 # Else assume that it's a ForignKey or many-to-many relation.
                 else:
                     list_of_groups = []
@@ -139,10 +138,10 @@ class MultipleGroupCategoriesBackend(ModelBackend):
                     for group in list_of_groups:
                         # If group_field is an instance of Group (or subclass)
                         if isinstance(group, Group):
-                            query = query | Q(**{'group': group})
+                            group_pks.add(group.pk)
                         else:
                             raise Exception("%s is not an acceptable field for permission handling 2." % group_type_name)
 
-            return Permission.objects.filter(query)
+            return Permission.objects.filter(group__pk__in=group_pks).distinct()
         else:
             return Permission.objects.none()
@@ -0,0 +1,34 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+
+from .utils import get_setting
+
+
+def get_password_hashing_workers():
+    """
+    :return Number of processes to hash passwords in, the setting PASSWORD_HASHING_WORKERS or by default half the CPU
+    count, at most 4, so that an upload does not take all of the CPU from the web server.
+    """
+    return get_setting('PASSWORD_HASHING_WORKERS') or max(1, min(4, (os.cpu_count() or 1) // 2))
+
+
+def make_passwords(passwords, max_workers=None):
+    """
+    Hashes many passwords like make_password, in parallel over a pool of processes since hashing is CPU bound and
+    holds the GIL. Passwords that are None give unusable passwords, like in make_password.
+    :param max_workers: Number of processes, defaults to get_password_hashing_workers().
+    :return List of the encoded passwords, in the order of passwords.
+    """
+    passwords = list(passwords)
+    max_workers = min(max_workers or get_password_hashing_workers(), len(passwords))
+    if max_workers <= 1:
+        return [make_password(password) for password in passwords]
+
+    # Not forked from the web server process, which has threads (e.g. the export jobs) that may hold locks
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('forkserver')) as executor:
+        return list(executor.map(make_password, passwords,
+                                 chunksize=math.ceil(len(passwords) / (max_workers * 4))))
@@ -0,0 +1,26 @@
+import authentication.utils as utils
+from .permissions import PermissionSnapshot, get_permission_snapshot
+
+
+class PermissionSnapshotMiddleware:
+    """
+    Keeps the permission snapshot of request.user in the session (if PERMISSION_SNAPSHOT_IN_SESSION is set) and
+    reuses it between requests until groups or permissions change or PERMISSION_SNAPSHOT_MAX_AGE seconds pass.
+    Without the setting snapshots are only computed lazily, once per request.
+
+    Must be placed after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if utils.get_setting('PERMISSION_SNAPSHOT_IN_SESSION') and hasattr(request, 'session') and \
+                hasattr(request, 'user') and request.user.is_authenticated:
+            snapshot = PermissionSnapshot.from_session(request.session, request.user)
+            if snapshot is None:
+                snapshot = get_permission_snapshot(request.user)
+                snapshot.save_to_session(request.session)
+            request.user._permission_snapshot = snapshot
+
+        return self.get_response(request)
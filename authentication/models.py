@@ -4,8 +4,10 @@ from django.contrib.auth import get_backends
 from django.contrib.auth.models import Group, AbstractBaseUser, PermissionsMixin, AbstractUser
 from django.core import validators
 from django.db import models
+from django.dispatch import receiver
 
 from .managers import AuthUserManager
+from .permissions import bump_permission_version
 from .model_fields import MultipleStringChoiceField
 
 class AuthUser(AbstractUser):
@@ -75,3 +77,18 @@ class UserProfile(models.Model):
             return '%s' % str(self.auth_user.email)
         except:
             return 'User profile has no AuthUser'
+
+
+@receiver(models.signals.m2m_changed, sender=AuthUser.groups.through)
+@receiver(models.signals.m2m_changed, sender=AuthUser.user_permissions.through)
+@receiver(models.signals.m2m_changed, sender=Group.permissions.through)
+def invalidate_permission_snapshots_m2m(sender, action, *args, **kwargs):
+    """ Invalidates stored permission snapshots when group memberships or permissions change. """
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        bump_permission_version()
+
+
+@receiver(models.signals.post_delete, sender=Group)
+def invalidate_permission_snapshots_delete(sender, *args, **kwargs):
+    """ Invalidates stored permission snapshots when a group is deleted. """
+    bump_permission_version()
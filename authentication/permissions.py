@@ -0,0 +1,89 @@
+import time
+
+import authentication.utils as utils
+
+PERMISSION_VERSION_CACHE_KEY = 'authentication:permission_version'
+PERMISSION_SNAPSHOT_SESSION_KEY = '_permission_snapshot'
+
+
+def get_permission_version():
+    """ Returns the current version of the permission configuration (groups and permissions of all users). """
+    return utils.get_cache_version(PERMISSION_VERSION_CACHE_KEY)
+
+
+def bump_permission_version():
+    """ Invalidates all stored permission snapshots. Call whenever groups or permissions change. """
+    utils.bump_cache_version(PERMISSION_VERSION_CACHE_KEY)
+
+
+class PermissionSnapshot:
+    """
+    Immutable view of the permissions of an AuthUser at a given point in time.
+    Answers has_perm like AuthUser.has_perm (for permissions without objects) without touching the database.
+    """
+
+    def __init__(self, user_pk, is_active, is_superuser, permissions, version=None, created_at=None):
+        self.user_pk = user_pk
+        self.is_active = is_active
+        self.is_superuser = is_superuser
+        self.permissions = frozenset(permissions)
+        self.version = version
+        self.created_at = created_at if created_at is not None else time.time()
+
+    @classmethod
+    def for_user(cls, auth_user):
+        """ Computes a fresh snapshot of auth_user. """
+        version = get_permission_version()
+        if auth_user.is_active and auth_user.is_superuser:
+            permissions = []
+        else:
+            permissions = auth_user.get_all_permissions()
+        return cls(auth_user.pk, auth_user.is_active, auth_user.is_superuser, permissions, version)
+
+    def has_perm(self, codename):
+        if not self.is_active:
+            return False
+        return self.is_superuser or codename in self.permissions
+
+    def has_perms(self, codenames):
+        return all(self.has_perm(codename) for codename in codenames)
+
+    def is_valid_for(self, auth_user):
+        """ Tells if the snapshot still describes auth_user. """
+        max_age = utils.get_setting('PERMISSION_SNAPSHOT_MAX_AGE')
+        return self.user_pk == auth_user.pk and \
+               self.is_active == auth_user.is_active and \
+               self.is_superuser == auth_user.is_superuser and \
+               self.version == get_permission_version() and \
+               (max_age is None or time.time() - self.created_at < max_age)
+
+    @classmethod
+    def from_session(cls, session, auth_user):
+        """ Returns the snapshot stored in session if it is still valid for auth_user, otherwise None. """
+        data = session.get(PERMISSION_SNAPSHOT_SESSION_KEY)
+        if not data:
+            return None
+        try:
+            snapshot = cls(**data)
+        except TypeError:
+            return None
+        return snapshot if snapshot.is_valid_for(auth_user) else None
+
+    def save_to_session(self, session):
+        session[PERMISSION_SNAPSHOT_SESSION_KEY] = {
+            'user_pk': self.user_pk,
+            'is_active': self.is_active,
+            'is_superuser': self.is_superuser,
+            'permissions': sorted(self.permissions),
+            'version': self.version,
+            'created_at': self.created_at,
+        }
+
+
+def get_permission_snapshot(auth_user):
+    """ Returns the snapshot of auth_user, computing it at most once per AuthUser instance (i.e. per request). """
+    snapshot = getattr(auth_user, '_permission_snapshot', None)
+    if snapshot is None or snapshot.user_pk != auth_user.pk:
+        snapshot = PermissionSnapshot.for_user(auth_user)
+        auth_user._permission_snapshot = snapshot
+    return snapshot
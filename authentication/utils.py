@@ -1,13 +1,19 @@
+import random
+import time
 from urllib.parse import urlunparse, urlencode
 
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.cache import cache
 from django.shortcuts import resolve_url
 
 # TODO: Understand and modify functions. Remove any unwanted or unnecessary functionality.
 
 DEFAULT_SETTING_VALUES = {
     'CAS_SERVER_URL': 'https://login.kth.se/',
+    'PERMISSION_SNAPSHOT_IN_SESSION': False,
+    'PERMISSION_SNAPSHOT_MAX_AGE': 60,
+    'PASSWORD_HASHING_WORKERS': None,  # None for half the CPU count, at most 4
 }
 
 def get_setting(setting_name):
@@ -68,4 +74,34 @@ def get_service_url(request, redirect_url=None, service_url=None):
     # parameter upon checking the credentials - ensure it is ignored
     query_params.pop('ticket', None)
     service_url += '?' + urlencode(query_params)
-    return service_url
\ No newline at end of file
+    return service_url
+
+
+def _get_new_cache_version(previous_version=None):
+    """
+    Version counters are set to the time in microseconds plus a random part, rather than counted from 1. A counter lost
+    from the cache (culled or cleared) thereby never starts over at a version used before, which would revive stale
+    cached data, and concurrent bumps do not end up at the same version.
+    """
+    version = int(time.time() * 1000) * 1000 + random.randrange(1000)
+    if previous_version is not None and version <= previous_version:
+        version = previous_version + 1 + random.randrange(1000)
+    return version
+
+
+def get_cache_version(key):
+    """ Returns the version counter stored in the cache under key, starting it if missing. """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _get_new_cache_version(), None)
+        version = cache.get(key)
+    return version if version is not None else _get_new_cache_version()
+
+
+def bump_cache_version(key):
+    """
+    Sets the version counter stored in the cache under key to a new version, invalidating all data cached by the old
+    one. Written with a new version rather than incremented, since incr is not atomic in all cache backends and does
+    not keep the timeout of the counter.
+    """
+    cache.set(key, _get_new_cache_version(cache.get(key)), None)
@@ -232,6 +232,19 @@ class RegistrationAdmin(admin.ModelAdmin):
     readonly_fields = ['happening', 'user', 'created_at', 'updated_at', 'paid', 'attended']
 
 
+class PaymentTransactionAdmin(admin.ModelAdmin):
+    list_display = ['imported_at', 'source', 'OCR', 'amount', 'status', 'registration']
+    list_filter = ['source', 'status']
+    search_fields = ['OCR', 'row']
+    readonly_fields = ['source', 'row', 'OCR', 'amount', 'status', 'registration', 'imported_at', 'imported_by']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 class DynamicNolleFormQuestionAnswerAdmin(admin.TabularInline):
     fields = ("pk", "value", "group")
     readonly_fields = ("pk", "value", "group")
@@ -321,6 +334,7 @@ superadmin_admin_site.register(models.HappeningSettings, SingeltonAdmin)
 superadmin_admin_site.register(models.UserProfile, UserProfileAdmin)
 superadmin_admin_site.register(models.NolleGroup, NolleGroupsRestrictedAdmin)
 superadmin_admin_site.register(models.Registration, RegistrationAdmin)
+superadmin_admin_site.register(models.PaymentTransaction, PaymentTransactionAdmin)
 superadmin_admin_site.register(models.Site, SiteAdmin)
 superadmin_admin_site.register(models.SiteSettings, SingeltonAdmin)
 superadmin_admin_site.register(models.SiteParagraphList, SiteParagraphListAdmin)
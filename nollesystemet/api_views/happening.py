@@ -0,0 +1,25 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from nollesystemet.models import Happening
+
+
+@api_view(['GET'])
+@renderer_classes([JSONRenderer])
+def get_happening_statistics(request, pk, format=None):
+    """ Retrieve the registration counts of a happening, see Happening.get_statistics. """
+
+    if request.user.is_anonymous or not request.user.is_authenticated:
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        happening = Happening.objects.get(pk=pk)
+    except Happening.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    if not happening.can_see_registered(request.user.profile):
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+    return Response(data=happening.get_cached_statistics())
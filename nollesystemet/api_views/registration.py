@@ -7,7 +7,7 @@ from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated, BasePermission
 from rest_framework.response import Response
 
-from nollesystemet.models import Registration
+from nollesystemet.models import Registration, Happening
 
 
 class RegistrationSerializer(serializers.ModelSerializer):
@@ -76,7 +76,7 @@ class PaymentHandlingAllowed(BasePermission):
 
 
 class RegistrationList(ListAPIView):
-    queryset = Registration.objects.all()
+    queryset = Registration.objects.with_prices().select_related('user')
     serializer_class = RegistrationSerializer
     permission_classes = [IsAuthenticated, PaymentHandlingAllowed]
     filter_backends = [
@@ -112,6 +112,7 @@ def update_registration(request, pk, format=None):
 
     if len(update_kwargs) > 0:
         Registration.objects.filter(pk=pk).update(**update_kwargs)
+        Happening.update_counters(Registration.objects.filter(pk=pk).values_list('happening', flat=True))
 
     return Response(status=status.HTTP_202_ACCEPTED)
 
@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def sync_sites(sender, **kwargs):
+    """ Creates the content of all sites used by views after migrations, so that requests never have to. """
+    from .mixins import SiteMixin
+    from .models import Site
+    Site.sync_sites(SiteMixin.get_site_definitions())
+
 
 class NollesystemetConfig(AppConfig):
     name = 'nollesystemet'
     verbose_name = 'nØllesystemet'
+
+    def ready(self):
+        from . import checks
+        post_migrate.connect(sync_sites, sender=self)
@@ -0,0 +1,33 @@
+from django.core import checks
+import django.contrib.staticfiles.finders as finders
+
+from .menu import Menu
+
+
+def _menu_static_files():
+    from .mixins import MenuMixin
+
+    static_files, classes = set(), [MenuMixin]
+    while classes:
+        cls = classes.pop()
+        if cls.menu_items_static_file:
+            static_files.add(cls.menu_items_static_file)
+        classes.extend(cls.__subclasses__())
+    return sorted(static_files)
+
+
+@checks.register(checks.Tags.urls)
+def check_menu_files(app_configs, **kwargs):
+    """ Compiles every menu file used by a view, so that errors in them are found at startup instead of per request. """
+    errors = []
+    for static_file in _menu_static_files():
+        path = finders.find(static_file)
+        if path is None:
+            errors.append(checks.Error("Menu file %s not found." % static_file, id='nollesystemet.E001'))
+            continue
+        try:
+            Menu.from_file(path).validate()
+        except Exception as e:
+            errors.append(checks.Error(
+                "Menu file %s is wrongly configured." % static_file, hint=str(e), id='nollesystemet.E002'))
+    return errors
@@ -0,0 +1,255 @@
+import collections
+import csv
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse, FileResponse
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from authentication.utils import get_cache_version, bump_cache_version
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DATA_VERSION_CACHE_KEY = 'nollesystemet:export_data_version:%s'
+
+# Scopes of data versions. Exports depend on one or more scopes and are regenerated when any of them is bumped.
+USERS_EXPORT_SCOPE = 'users'
+HAPPENING_EXPORT_SCOPE = 'happening:%s'
+NOLLE_FORM_EXPORT_SCOPE = 'nolleform'
+
+
+def get_export_data_version(*scopes):
+    """ :return String of the current versions of the data in scopes. """
+    return '-'.join([str(get_cache_version(EXPORT_DATA_VERSION_CACHE_KEY % scope)) for scope in scopes])
+
+
+def bump_export_data_version(scope):
+    """ Makes the cached exports depending on scope stale. Call whenever data in scope changes. """
+    bump_cache_version(EXPORT_DATA_VERSION_CACHE_KEY % scope)
+
+
+class Echo:
+    """ File-like object returning what is written to it, for writing csv rows straight into a streamed response. """
+
+    def write(self, value):
+        return value
+
+
+class ExportWriter:
+    """
+    Writes the rows of an export (lists of raw column values) in some file format. Subclasses implement write, which
+    writes the whole file to a binary file object.
+    """
+    file_extension = None
+    content_type = None
+
+    def write(self, titles, rows, file):
+        raise NotImplementedError()
+
+    def get_file_name(self, file_name):
+        return file_name + '.' + self.file_extension
+
+    def get_response(self, titles, rows, file_name):
+        """ :return Response with the file as attachment. Written to a temporary file first, in constant memory. """
+        file = tempfile.TemporaryFile()
+        self.write(titles, rows, file)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename=self.get_file_name(file_name),
+                            content_type=self.content_type)
+
+
+class StreamingExportWriter(ExportWriter):
+    """ ExportWriter for formats that can be produced row by row, which are streamed to the client as produced. """
+
+    def iterate(self, titles, rows):
+        """ :return Generator of the file content, as strings. """
+        raise NotImplementedError()
+
+    def write(self, titles, rows, file):
+        for chunk in self.iterate(titles, rows):
+            file.write(chunk.encode('utf-8'))
+
+    def get_response(self, titles, rows, file_name):
+        response = StreamingHttpResponse(self.iterate(titles, rows), content_type=self.content_type)
+        response['Content-Disposition'] = 'attachment; filename="' + self.get_file_name(file_name) + '"'
+        return response
+
+
+class CsvExportWriter(StreamingExportWriter):
+    file_extension = 'csv'
+    content_type = 'text/csv'
+
+    def __init__(self, delimiter=','):
+        self.delimiter = delimiter
+
+    @staticmethod
+    def format_value(value):
+        if value is None or isinstance(value, str):
+            pass
+        elif isinstance(value, collections.abc.Iterable):
+            value = ', '.join([str(v) for v in value])
+        else:
+            value = str(value)
+
+        # Remove newlines
+        if isinstance(value, str):
+            value = value.replace('\n', ' ').replace('\r', '')
+        return value
+
+    def iterate(self, titles, rows):
+        writer = csv.writer(Echo(), delimiter=self.delimiter, lineterminator='\n')
+        yield writer.writerow(titles)
+        for row in rows:
+            yield writer.writerow([self.format_value(value) for value in row])
+
+
+class JsonLinesExportWriter(StreamingExportWriter):
+    """ One JSON object per row, keyed by the column titles (numbered if not unique). """
+    file_extension = 'jsonl'
+    content_type = 'application/x-ndjson'
+
+    @staticmethod
+    def format_value(value):
+        if value is None or isinstance(value, (str, bool, int, float)):
+            return value
+        elif isinstance(value, collections.abc.Iterable):
+            return [str(v) for v in value]
+        else:
+            return str(value)
+
+    @staticmethod
+    def get_keys(titles):
+        keys = []
+        for title in titles:
+            key, number = str(title), 1
+            while key in keys:
+                number += 1
+                key = '%s (%d)' % (title, number)
+            keys.append(key)
+        return keys
+
+    def iterate(self, titles, rows):
+        keys = self.get_keys(titles)
+        for row in rows:
+            yield json.dumps({key: self.format_value(value) for key, value in zip(keys, row)},
+                             ensure_ascii=False) + '\n'
+
+
+class XlsxExportWriter(ExportWriter):
+    """ Excel workbook with one sheet, written with the write-only mode of openpyxl to keep memory use constant. """
+    file_extension = 'xlsx'
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    @staticmethod
+    def format_value(value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if not isinstance(value, str):
+            if isinstance(value, collections.abc.Iterable):
+                value = ', '.join([str(v) for v in value])
+            else:
+                value = str(value)
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+
+    def write(self, titles, rows, file):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(titles)
+        for row in rows:
+            sheet.append([self.format_value(value) for value in row])
+        workbook.save(file)
+
+
+EXPORT_WRITERS = {
+    'csv': CsvExportWriter,
+    'xlsx': XlsxExportWriter,
+    'jsonl': JsonLinesExportWriter,
+}
+
+
+def get_export_path(export_name, data_version, titles, export_writer):
+    """
+    :return Path of the artifact of an export in settings.EXPORT_ROOT. The file name is derived from the data version
+    and column titles with the secret key, so that the names of the exports containing personal data can not be
+    guessed.
+    """
+    message = '\n'.join([export_name, data_version] + [str(title) for title in titles])
+    digest = hmac.new(settings.SECRET_KEY.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+    return os.path.join(settings.EXPORT_ROOT, export_name, digest + '.' + export_writer.file_extension)
+
+
+_executor = None
+_jobs = {}
+_jobs_lock = threading.RLock()  # Reentrant, done callbacks of finished jobs run at once
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'EXPORT_JOB_WORKERS', 2),
+                                       thread_name_prefix='export')
+    return _executor
+
+
+def _write_export(path, export_writer, get_titles_and_rows):
+    """
+    Writes an export to path, through a temporary file in the same directory so that the artifact appears
+    atomically. Artifacts of the same export and format written before the job started are removed, but not those
+    written meanwhile by jobs of other processes, which may be of a newer version. Run by the export job threads.
+    """
+    started_at = time.time()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    file = tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False)
+    try:
+        with file:
+            export_writer.write(*get_titles_and_rows(), file)
+        os.replace(file.name, path)
+    except Exception:
+        logger.exception("Export to %s failed.", path)
+        os.remove(file.name)
+        raise
+    finally:
+        connections.close_all()
+
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.' + export_writer.file_extension) and file_name != os.path.basename(path):
+            try:
+                if os.path.getmtime(os.path.join(directory, file_name)) < started_at:
+                    os.remove(os.path.join(directory, file_name))
+            except FileNotFoundError:
+                pass
+
+
+def request_export(path, export_writer, get_titles_and_rows):
+    """
+    Starts a background job writing an export to path, unless the artifact exists or is already being written by
+    this process.
+    :param get_titles_and_rows: Callable returning the column titles and the rows of the export, called by the job.
+    :return Future of the job, or None if the artifact already exists.
+    """
+    if os.path.exists(path):
+        return None
+
+    with _jobs_lock:
+        future = _jobs.get(path)
+        if future is None:
+            future = _get_executor().submit(_write_export, path, export_writer, get_titles_and_rows)
+            _jobs[path] = future
+
+            def forget_job(done_future):
+                with _jobs_lock:
+                    if _jobs.get(path) is done_future:
+                        del _jobs[path]
+            future.add_done_callback(forget_job)
+    return future
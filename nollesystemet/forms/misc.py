@@ -1,5 +1,4 @@
 import csv
-from io import StringIO
 
 import django.forms as forms
 from crispy_forms.helper import FormHelper
@@ -580,54 +579,70 @@ class CsvFileAdministrationForm(ObjectsAdministrationForm):
             if len(in_arrays) > 1:
                 raise Exception("%s is defined in multiple parsing column arrays. Maximum one allowed." % column_name)
 
+    def get_parsing_maps(self):
+        """
+        Reads what the parsing columns can be parsed to once per upload, with one query per object column.
+        :return Tuple of dicts from column name to a dict from cell value to enum member or object, for the enum
+        columns and the object columns.
+        """
+        enum_maps = {column_name: dict(enum_class.__members__) for column_name, enum_class, _ in self.enum_columns}
+        object_maps = {column_name: {obj.name: obj for obj in model.objects.all()}
+                       for column_name, model, _ in self.object_columns}
+        return enum_maps, object_maps
+
+    @staticmethod
+    def decode_lines(file):
+        """ :return Generator of the lines of the uploaded file, decoded one at a time. """
+        for line in file:
+            yield line.decode('utf-8')
+
     def read_and_verify_file_content(self):
         file = self.files.get('upload_objects_file')
         if file:
             try:
-                file = file.read().decode('utf-8')
-                user_reader = csv.DictReader(StringIO(file), delimiter=self.delimiter, fieldnames=self.file_columns)
+                user_reader = csv.DictReader(self.decode_lines(file), delimiter=self.delimiter,
+                                             fieldnames=self.file_columns)
                 next(user_reader)
             except:
                 raise ValidationError("Filen kunde inte läsas.\n"
                                       "Se till att den har utf-8 format och %s som avskiljare." % self.delimiter)
 
+            enum_maps, object_maps = self.get_parsing_maps()
             errors = []
             users = []
-            for row, user_info in enumerate(user_reader):
-                if self.remove_none_column:
-                    if None in user_info:
-                        user_info.pop(None)
-
-                for column_name in self.file_columns:
-                    if not user_info[column_name]:
-                        if column_name in self.required_columns:
-                            errors.append("%s saknas (på rad %d)." % (column_name, row + 1))
-                        elif column_name in self.val_or_none_columns:
-                            user_info[column_name] = None
-                        elif column_name in self.val_or_blank_str_columns:
-                            user_info[column_name] = ""
-
-                for column_name, enum_class, is_nullable in self.enum_columns:
-                    try:
-                        user_info[column_name] = enum_class.__getattr__(user_info[column_name])
-                    except AttributeError:
-                        if is_nullable:
-                            user_info[column_name] = None
-                        else:
+            row = -1  # Index of the last row read, for the error of a file that cannot be read
+            try:
+                for row, user_info in enumerate(user_reader):
+                    if self.remove_none_column:
+                        if None in user_info:
+                            user_info.pop(None)
+
+                    for column_name in self.file_columns:
+                        if not user_info[column_name]:
+                            if column_name in self.required_columns:
+                                errors.append("%s saknas (på rad %d)." % (column_name, row + 1))
+                            elif column_name in self.val_or_none_columns:
+                                user_info[column_name] = None
+                            elif column_name in self.val_or_blank_str_columns:
+                                user_info[column_name] = ""
+
+                    for column_name, enum_class, is_nullable in self.enum_columns:
+                        value = enum_maps[column_name].get(user_info[column_name])
+                        if value is None and not is_nullable:
                             errors.append("%s kan inte göras till %s (på rad %d)." %
-                                          (user_info[column_name], enum_class.__name__(), row + 1))
-
-                for column_name, model, is_nullable in self.object_columns:
-                    try:
-                        user_info[column_name] = model.objects.get(name=user_info[column_name])
-                    except model.DoesNotExist:
-                        if is_nullable:
-                            user_info[column_name] = None
-                        else:
+                                          (user_info[column_name], enum_class.__name__, row + 1))
+                        user_info[column_name] = value
+
+                    for column_name, model, is_nullable in self.object_columns:
+                        value = object_maps[column_name].get(user_info[column_name])
+                        if value is None and not is_nullable:
                             errors.append("%s kan inte göras till %s (på rad %d)." %
-                                          (user_info[column_name], model.__name__(), row + 1))
+                                          (user_info[column_name], model.__name__, row + 1))
+                        user_info[column_name] = value
 
-                users.append(user_info)
+                    users.append(user_info)
+            except (UnicodeDecodeError, csv.Error):
+                errors.append("Filen kunde inte läsas efter rad %d. Se till att den har utf-8 format." % (row + 1))
 
             if errors:
                 raise ValidationError("\n".join(errors))
@@ -93,7 +93,7 @@ class NolleFormBaseForm(ModifiableModelForm):
             self.instance.user = user
 
     def add_fields(self, **kwargs):
-        for question in DynamicNolleFormQuestion.objects.all():
+        for question in DynamicNolleFormQuestion.objects.prefetch_related('dynamicnolleformquestionanswer_set'):
             if question.question_type == DynamicNolleFormQuestion.QuestionType.TEXT:
                 self.fields['q_' + str(question.pk)] = DynamicQuestionCharField(
                     question,
@@ -150,10 +150,17 @@ class RegistrationForm(ModifiableModelForm):
                     )
                 )
 
+    def _save_m2m(self):
+        super()._save_m2m()
+        self.instance.pending_extra_options = None
+
     def save(self, commit=True):
         if self.is_new:
             self.instance.happening = self.happening
             self.instance.user = self.user
+        if 'extra_option' in self.cleaned_data:
+            # Priced by Registration.save before the extra options themselves are saved
+            self.instance.pending_extra_options = list(self.cleaned_data['extra_option'])
 
         registration = super().save(commit)
         if self.is_new:
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from authentication.hashers import make_passwords, get_password_hashing_workers
+
+
+class Command(BaseCommand):
+    help = 'Measures how fast passwords are hashed by bulk imports with different numbers of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passwords', type=int, default=64, help='Number of passwords to hash per run.')
+        parser.add_argument('--max-workers', type=int, default=None,
+                            help='Largest number of processes to try. Defaults to PASSWORD_HASHING_WORKERS.')
+
+    def handle(self, *args, **options):
+        passwords = ['password%d' % i for i in range(options['passwords'])]
+        max_workers = options['max_workers'] or get_password_hashing_workers()
+
+        workers_to_try = sorted({max_workers} | {2 ** i for i in range(max_workers.bit_length())})
+        serial_time = None
+        for workers in workers_to_try:
+            start = time.perf_counter()
+            make_passwords(passwords, max_workers=workers)
+            elapsed = time.perf_counter() - start
+            serial_time = serial_time or elapsed
+            self.stdout.write('%3d processes: %6.2f s, %7.1f passwords/s, speedup %.2f' %
+                              (workers, elapsed, len(passwords) / elapsed, serial_time / elapsed))
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked password hashing!'))
@@ -4,12 +4,15 @@ from django.contrib.staticfiles import finders
 from django.core.management.base import BaseCommand
 import django.contrib.auth.models as django_auth_models
 from nollesystemet.models import *
+from nollesystemet.mixins import SiteMixin
 
 class Command(BaseCommand):
     """
     1) Create administrative groups and assign correct privileges.
     2) Check that a superuser with username 'admin' exists. Else create one. Assign authenticaiton groups.
     3) Create NolleGroups.
+    4) Create singeltons.
+    5) Create the content of all sites.
     """
 
     help = 'Restores all models to the given minimum requirements. Does not delete other stuff.'
@@ -71,6 +74,9 @@ class Command(BaseCommand):
         # 4) Create Singeltons
         HappeningSettings.load()
 
+        # 5) Create the content of all sites
+        Site.sync_sites(SiteMixin.get_site_definitions())
+
         # inf) End.
         if not ('print' in options and not options['print']):
             self.stdout.write(self.style.SUCCESS('Successfully re-initialized system!'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from nollesystemet.models import Registration, Happening
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized prices of all registrations and the registration counts of all happenings.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            num_of_registrations = len(Registration.update_denormalized_prices(Registration.objects.all()))
+            happening_pks = list(Happening.objects.values_list('pk', flat=True))
+            Happening.update_counters(happening_pks)
+
+        self.stdout.write(self.style.SUCCESS('Successfully recomputed %d registrations and %d happenings!' %
+                                             (num_of_registrations, len(happening_pks))))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from nollesystemet.mixins import SiteMixin
+from nollesystemet.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Creates the texts, images and paragraph lists used by the views of all sites and removes obsolete ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-redundant', action='store_true',
+                            help='Do not remove texts, images and paragraph lists no longer used by any view.')
+
+    def handle(self, *args, **options):
+        site_definitions = SiteMixin.get_site_definitions()
+        Site.sync_sites(site_definitions, clear_redundant=not options['keep_redundant'])
+
+        self.stdout.write(self.style.SUCCESS('Successfully synced %d sites!' % len(site_definitions)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from nollesystemet.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Loads the content of all sites into the cache.'
+
+    def handle(self, *args, **options):
+        site_names = list(Site.objects.values_list('name', flat=True))
+        for site_name in site_names:
+            Site.get_cached_site_content(site_name)
+
+        self.stdout.write(self.style.SUCCESS('Successfully cached %d sites!' % len(site_names)))
@@ -1,8 +1,34 @@
 from django.contrib.auth.models import BaseUserManager
 from django.apps import apps
 from django.conf import settings
+from django.db import models
 
-class UserProfileManager(BaseUserManager):
+
+class UserProfileQuerySet(models.QuerySet):
+    """ QuerySet with database side equivalents of the per-object permission methods of UserProfile. """
+
+    def visible_to(self, observing_user):
+        """ :return The users whose profile observing_user can see (UserProfile.can_see). """
+        if observing_user.has_perm('nollesystemet.edit_users') or observing_user.has_perm('nollesystemet.see_users'):
+            return self.all()
+
+        condition = models.Q(pk=observing_user.pk)
+        if observing_user.user_type == self.model.UserType.FORFADDER:
+            condition |= models.Exists(
+                apps.get_model('nollesystemet.NolleGroup').forfadders.through.objects.filter(
+                    nollegroup=models.OuterRef('nolle_group'), userprofile=observing_user.pk
+                )
+            )
+        return self.filter(condition)
+
+    def editable_by(self, observing_user):
+        """ :return The users whose profile observing_user can edit (UserProfile.can_edit). """
+        if observing_user.has_perm('nollesystemet.edit_users'):
+            return self.all()
+        return self.filter(pk=observing_user.pk)
+
+
+class UserProfileManager(BaseUserManager.from_queryset(UserProfileQuerySet)):
     use_in_migrations = True
 
     def _create_user(self, username, password, first_name, last_name, user_type, **extra_fields):
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.template import Template
+from django.urls import reverse
+from django.utils.functional import cached_property
+import django.contrib.staticfiles.finders as finders
+
+from authentication.permissions import get_permission_version
+from authentication.utils import get_cache_version, bump_cache_version
+
+CONDITION_KEYS = ["logged-in", "methods", "permissions"]
+QUANTIFIER_KEYS = ["any", "all"]
+LOGGED_IN_VALUES = {"True": True, "False": False, "any": None}
+ALIGNMENTS = ["left", "right"]
+
+MENU_DATA_VERSION_CACHE_KEY = 'nollesystemet:menu_data_version'
+MENU_CACHE_TIMEOUT = 60 * 60
+LOCAL_MENU_CACHE_SIZE = 1000
+
+
+def get_menu_data_version():
+    """ Returns the current version of the data (other than permissions) that the menu conditions depend on. """
+    return get_cache_version(MENU_DATA_VERSION_CACHE_KEY)
+
+
+def bump_menu_data_version():
+    """ Invalidates all cached menus. Call whenever data used by the menu condition methods change. """
+    bump_cache_version(MENU_DATA_VERSION_CACHE_KEY)
+
+
+class MenuItem:
+    """
+    One compiled entry of a menu file. Conditions are validated and method strings resolved when the item is created,
+    the url and selection regex are resolved on first use (reverse() needs the url configuration to be loaded).
+    """
+
+    def __init__(self, key, info):
+        self.key = key
+        self.name = info.get('name', key)
+        self.classes = info.get('classes', '')
+        self.selected_url_regex = info.get('selected_url_regex', '.*')
+
+        if 'url_name' not in info:
+            raise ImproperlyConfigured("Wrongly configured menu file. Menu-item %s has no url_name." % key)
+        self.url_name = info['url_name']
+
+        if info.get('align') not in ALIGNMENTS:
+            raise ImproperlyConfigured(
+                "Wrongly configured menu file. For menu-item %s the align parameter must be one of %s." %
+                (key, ', '.join(ALIGNMENTS)))
+        self.align = info['align']
+
+        self.template = Template(info['template_content']) if 'template_content' in info else None
+
+        conditions = info.get('conditions', {})
+        for condition_key in conditions.keys():
+            if condition_key not in CONDITION_KEYS:
+                raise ImproperlyConfigured(
+                    "Wrongly configured menu file. For menu-item %s the conditions parameter can not have key %s." %
+                    (key, condition_key))
+
+        logged_in = conditions.get('logged-in', 'any')
+        if logged_in not in LOGGED_IN_VALUES:
+            raise ImproperlyConfigured(
+                "Wrongly configured menu file. For menu-item %s the conditions.logged-in parameter can not be %s." %
+                (key, logged_in))
+        self.logged_in = LOGGED_IN_VALUES[logged_in]
+
+        self.methods = self._compile_quantifiers(conditions, 'methods', self._resolve_method)
+        self.permissions = self._compile_quantifiers(conditions, 'permissions', lambda codename: codename)
+
+    def _compile_quantifiers(self, conditions, condition_key, compile_value):
+        """ :return None if the condition is not used, otherwise a tuple (any, all) of compiled values or None. """
+        if condition_key not in conditions:
+            return None
+
+        for quantifier in conditions[condition_key].keys():
+            if quantifier not in QUANTIFIER_KEYS:
+                raise ImproperlyConfigured(
+                    "Wrongly configured menu file. For menu-item %s the conditions.%s parameter can not have key %s." %
+                    (self.key, condition_key, quantifier))
+
+        return tuple(
+            [compile_value(value) for value in conditions[condition_key][quantifier]]
+            if quantifier in conditions[condition_key] else None
+            for quantifier in QUANTIFIER_KEYS
+        )
+
+    def _resolve_method(self, method_string):
+        try:
+            app_label, model_name, method_name = method_string.split(".")
+            method = getattr(apps.get_model(app_label=app_label, model_name=model_name), method_name)
+        except (ValueError, LookupError, AttributeError):
+            raise ImproperlyConfigured(
+                "Wrongly configured menu file. For menu-item %s the method %s could not be found." %
+                (self.key, method_string))
+        if not callable(method):
+            raise ImproperlyConfigured(
+                "Wrongly configured menu file. For menu-item %s %s is not callable." % (self.key, method_string))
+        return method
+
+    @cached_property
+    def url(self):
+        return reverse(self.url_name)
+
+    @cached_property
+    def selected_regex(self):
+        return re.compile(self.url + self.selected_url_regex)
+
+    @staticmethod
+    def _evaluate_quantifiers(quantifiers, evaluate):
+        if quantifiers is None:
+            return True
+        any_values, all_values = quantifiers
+        return (any_values is None or any(evaluate(value) for value in any_values)) and \
+               (all_values is None or all(evaluate(value) for value in all_values))
+
+    def should_render(self, user):
+        """ :return Boolean indicating if the conditions of the item are fulfilled for user. """
+        if self.logged_in is not None and self.logged_in != user.is_authenticated:
+            return False
+
+        if self.methods is None and self.permissions is None:
+            return True
+        if not user.is_authenticated:
+            return False
+
+        profile = user.profile
+        return self._evaluate_quantifiers(self.methods, lambda method: method(profile)) and \
+               self._evaluate_quantifiers(self.permissions, profile.has_perm)
+
+    def is_selected(self, path):
+        return self.selected_regex.search(path) is not None
+
+    def get_label(self, context):
+        return self.template.render(context) if self.template is not None else self.name
+
+    def validate(self):
+        """ Resolves everything that is resolved lazily, raising ImproperlyConfigured on failure. """
+        try:
+            self.selected_regex
+        except re.error as e:
+            raise ImproperlyConfigured(
+                "Wrongly configured menu file. For menu-item %s the selected_url_regex is invalid: %s" % (self.key, e))
+        except Exception as e:
+            raise ImproperlyConfigured(
+                "Wrongly configured menu file. For menu-item %s the url %s could not be resolved: %s" %
+                (self.key, self.url_name, e))
+
+
+class Menu:
+    """
+    A compiled menu file. The order is a list of groups of menu items, of which the first one to render is shown.
+    """
+
+    def __init__(self, data, path='', fingerprint=''):
+        self.fingerprint = fingerprint
+        order = data.get('order') if isinstance(data, dict) else None
+        menu_items = data.get('menu_items') if isinstance(data, dict) else None
+        if not order or not menu_items:
+            raise ImproperlyConfigured("order or menu_items not found in file %s" % path)
+
+        items = {}
+        self.groups = []
+        for group in order:
+            if not isinstance(group, list):
+                group = [group]
+            for key in group:
+                if key not in menu_items:
+                    raise ImproperlyConfigured("Menu-item %s in order not found in file %s" % (key, path))
+                if key not in items:
+                    items[key] = MenuItem(key, menu_items[key])
+            self.groups.append([items[key] for key in group])
+        self.items = list(items.values())
+        self.items_by_key = items
+        self._local_cache = OrderedDict()
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, 'rb') as json_file:
+                content = json_file.read()
+            data = json.loads(content.decode('utf-8'))
+        except (OSError, TypeError, ValueError):
+            raise FileNotFoundError("Menu file %s not able to be read." % path)
+        return cls(data, path, hashlib.md5(content).hexdigest())
+
+    def get_visible_items(self, user):
+        """ :return List of the menu items to show to user, in order. """
+        visible_items = []
+        for group in self.groups:
+            for item in group:
+                if item.should_render(user):
+                    visible_items.append(item)
+                    break
+        return visible_items
+
+    def get_visible_items_cache_key(self, user):
+        return 'nollesystemet:menu:%s:%s:%s:%s:%s:%s' % (
+            self.fingerprint, user.pk, int(user.is_active), int(user.is_superuser),
+            get_permission_version(), get_menu_data_version()
+        )
+
+    def get_cached_visible_items(self, user):
+        """
+        Same as get_visible_items, but the result for logged in users is cached per process and in the shared cache
+        until the permissions or the data used by the condition methods change.
+        """
+        if not user.is_authenticated:
+            return self.get_visible_items(user)
+
+        key = self.get_visible_items_cache_key(user)
+        item_keys = self._local_cache.get(key)
+        if item_keys is None:
+            item_keys = cache.get(key)
+            if item_keys is None or any(item_key not in self.items_by_key for item_key in item_keys):
+                item_keys = [item.key for item in self.get_visible_items(user)]
+                cache.set(key, item_keys, MENU_CACHE_TIMEOUT)
+            self._local_cache[key] = item_keys
+            if len(self._local_cache) > LOCAL_MENU_CACHE_SIZE:
+                self._local_cache.popitem(last=False)
+        return [self.items_by_key[item_key] for item_key in item_keys]
+
+    def build(self, request, visible_items=None):
+        """ :return Dict of the left and right menu for request, without labels (see render_labels). """
+        if visible_items is None:
+            visible_items = self.get_cached_visible_items(request.user)
+
+        menu = {side: [] for side in ALIGNMENTS}
+        for item in visible_items:
+            classes = item.classes
+            if item.is_selected(request.path):
+                classes = (classes + ' ' if classes else '') + 'selected'
+            menu[item.align].append({
+                'item': item,
+                'name': item.name,
+                'url': item.url,
+                'classes': classes,
+            })
+        return menu
+
+    @staticmethod
+    def render_labels(menu, context):
+        for side in ALIGNMENTS:
+            for menu_item in menu.get(side, []):
+                menu_item['label'] = menu_item['item'].get_label(context)
+
+    def validate(self):
+        for item in self.items:
+            item.validate()
+
+
+_menu_cache = {}
+
+
+def get_menu_path(static_file):
+    """ :return The path of the static menu file. During runserver it is found by the static files finders. """
+    if static_file is None:
+        raise FileNotFoundError("menu_items_static_file not set.")
+    if len(sys.argv) > 1 and sys.argv[1] == 'runserver':
+        return finders.find(static_file)
+    return os.path.join(settings.STATIC_ROOT, static_file)
+
+
+def get_menu(static_file):
+    """
+    :return The compiled Menu of static_file. Menus are compiled once per process, in debug mode they are
+    recompiled when the file is modified.
+    """
+    cached = _menu_cache.get(static_file)
+    if cached is not None and not settings.DEBUG:
+        return cached[1]
+
+    path = get_menu_path(static_file)
+    try:
+        mtime = os.stat(path).st_mtime
+    except (OSError, TypeError):
+        raise FileNotFoundError("menu_items_static_file %s not able to be read." % static_file)
+    if cached is not None and cached[0] == (path, mtime):
+        return cached[1]
+
+    menu = Menu.from_file(path)
+    _menu_cache[static_file] = ((path, mtime), menu)
+    return menu
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.10 on 2026-10-16 22:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nollesystemet', '0020_alter_campussafarigroup_side_quests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.PositiveSmallIntegerField(choices=[(1, 'Swish'), (2, 'Bankgiro')], verbose_name='Källa')),
+                ('content_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('row', models.TextField(blank=True, verbose_name='Rad')),
+                ('OCR', models.CharField(blank=True, max_length=100, verbose_name='OCR')),
+                ('amount', models.IntegerField(blank=True, null=True, verbose_name='Belopp')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Registrerad'), (2, 'Redan betald'), (3, 'Fel belopp'), (4, 'Okänt OCR-nummer'), (5, 'Oläslig rad')], verbose_name='Status')),
+                ('imported_at', models.DateTimeField(auto_now_add=True, verbose_name='Inläst')),
+                ('imported_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='nollesystemet.userprofile', verbose_name='Inläst av')),
+                ('registration', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_transactions', to='nollesystemet.registration', verbose_name='Anmälan')),
+            ],
+            options={
+                'verbose_name': 'Betalning',
+                'verbose_name_plural': 'Betalningar',
+                'ordering': ['-imported_at'],
+            },
+        ),
+    ]
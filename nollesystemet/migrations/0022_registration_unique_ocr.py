@@ -0,0 +1,37 @@
+import random
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def reassign_duplicate_OCRs(apps, schema_editor):
+    """ Gives new OCR numbers to all but the first registration of every duplicated OCR number. """
+    Registration = apps.get_model('nollesystemet', 'Registration')
+    duplicated_OCRs = Registration.objects.values('OCR').annotate(count=models.Count('pk')).filter(count__gt=1)
+    taken_OCRs = set(Registration.objects.values_list('OCR', flat=True))
+    format_string = '%0' + str(settings.OCR_NUMBER_NUM_DIGITS) + 'd'
+
+    for duplicate in duplicated_OCRs:
+        for registration in Registration.objects.filter(OCR=duplicate['OCR']).order_by('pk')[1:]:
+            OCR = duplicate['OCR']
+            while OCR in taken_OCRs:
+                OCR = format_string % random.randint(settings.OCR_NUMBER_LOW, settings.OCR_NUMBER_HIGH)
+            taken_OCRs.add(OCR)
+            registration.OCR = OCR
+            registration.save(update_fields=['OCR'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nollesystemet', '0021_paymenttransaction'),
+    ]
+
+    operations = [
+        migrations.RunPython(reassign_duplicate_OCRs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='registration',
+            name='OCR',
+            field=models.CharField(editable=False, max_length=6, unique=True),
+        ),
+    ]
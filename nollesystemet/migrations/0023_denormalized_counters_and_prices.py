@@ -0,0 +1,43 @@
+# Generated by Django 3.2.10 on 2026-10-16 22:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nollesystemet', '0022_registration_unique_ocr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='happening',
+            name='attended_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='happening',
+            name='confirmed_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='happening',
+            name='paid_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='happening',
+            name='registered_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='on_site_total',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='pre_paid_total',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
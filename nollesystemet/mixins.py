@@ -1,160 +1,34 @@
-import json
-import os
-import re
-import sys
 import urllib
 
-from django.apps import apps
-from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.mixins import PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.views import redirect_to_login
 from django.http import HttpResponseRedirect
-from django.template import Template, Context
-from django.urls import reverse, reverse_lazy
+from django.template import Context
+from django.urls import URLResolver, get_resolver, reverse_lazy
 from django.views.generic.base import ContextMixin
-import django.contrib.staticfiles.finders as finders
 import logging
 
 import nollesystemet.models as models
+from .menu import Menu, get_menu
 
 
 class MenuMixin(ContextMixin):
     menu_items_static_file = None
 
+    def get_menu(self):
+        return get_menu(self.menu_items_static_file)
+
     def get_context_data(self, **kwargs):
-        context = {}
-        try:
-            path = ""
-            if len(sys.argv) > 1 and sys.argv[1] == 'runserver':
-                path = finders.find(self.menu_items_static_file)
-            else:
-                path = os.path.join(settings.STATIC_ROOT, self.menu_items_static_file)
-
-            with open(path, encoding='utf-8') as json_file:
-                data = json.load(json_file)
-                order = data['order']
-                menu_items = data['menu_items']
-        except:
-            raise FileNotFoundError("menu_items_static_file not set or not able to be read.")
-
-        if not order or not menu_items:
-            raise SyntaxError("order or menu_items not found in file %s" % path)
-
-        menu = {'left': [], 'right': []}
-        for items in order:
-            if not isinstance(items, list):
-                items = [items]
-
-            for item in items:
-                info = menu_items[item]
-
-                render = self.check_if_to_render(info)
-
-                if render:
-                    menu[info['align']].append({
-                        **info,
-                        'url': reverse(info['url_name'])
-                    })
-
-                    if not 'selected_url_regex' in info:
-                        info['selected_url_regex'] = '.*'
-                    if re.search(menu[info['align']][-1]['url'] + info['selected_url_regex'], self.request.path):
-                        menu[info['align']][-1]['classes'] = \
-                            (info['classes'] + ' ' if 'classes' in info else '') + 'selected'
-                    break
-
-        if menu:
-            context['menu'] = menu
+        context = {
+            'menu': self.get_menu().build(self.request)
+        }
         context.update(kwargs)
         return super().get_context_data(**context)
 
-    def check_if_to_render(self, info):
-        if "conditions" in info:
-            conditions = info["conditions"]
-
-            for key in conditions.keys():
-                if key not in ["logged-in", "methods", "permissions"]:
-                    raise Exception(
-                        "Wrongly configured menu file."
-                        "For menu-item %s the conditions parameter can not have key %s.",
-                        (info["name"], key))
-
-            auth_render = False
-            if "logged-in" in conditions:
-                if conditions["logged-in"] == "True":
-                    auth_render = self.request.user.is_authenticated
-                elif conditions["logged-in"] == "False":
-                    auth_render = not self.request.user.is_authenticated
-                elif conditions["logged-in"] == "any":
-                    auth_render = True
-                else:
-                    raise Exception(
-                        "Wrongly configured menu file. "
-                        "For menu-item %s the conditions.logged-in parameter can not have key %s.",
-                        (info["name"], conditions["logged-in"]))
-            else:
-                auth_render = True
-
-            methods_render = False
-            if "methods" in conditions:
-                if self.request.user.is_authenticated:
-                    for key in conditions["methods"].keys():
-                        if key not in ["all", "any"]:
-                            raise Exception(
-                                "Wrongly configured menu file."
-                                "For menu-item %s the conditions.methods parameter can not have key %s.",
-                                (info["name"], key))
-                    if "any" in conditions["methods"]:
-                        for method_string in conditions["methods"]["any"]:
-                            split = method_string.split(".")
-                            model = apps.get_model(app_label=split[0], model_name=split[1])
-                            methods_render |= getattr(model, (split[2]))(self.request.user.profile)
-                    else:
-                        methods_render = True
-                    if "all" in conditions["methods"]:
-                        for method_string in conditions["methods"]["all"]:
-                            split = method_string.split(".")
-                            model = apps.get_model(app_label=split[0], model_name=split[1])
-                            methods_render &= getattr(model, (split[2]))(self.request.user.profile)
-            else:
-                methods_render = True
-
-            perms_render = False
-            if "permissions" in conditions:
-                if self.request.user.is_authenticated:
-                    for key in conditions["permissions"].keys():
-                        if key not in ["all", "any"]:
-                            raise Exception(
-                                "Wrongly configured menu file."
-                                "For menu-item %s the conditions.permissions parameter can not have key %s.",
-                                (info["name"], key))
-                    if "any" in conditions["permissions"]:
-                        for codename in conditions["permissions"]["any"]:
-                            perms_render |= self.request.user.has_perm(codename)
-                    else:
-                        perms_render = True
-                    if "all" in conditions["permissions"]:
-                        for codename in conditions["permissions"]["all"]:
-                            perms_render &= self.request.user.has_perm(codename)
-            else:
-                perms_render = True
-
-            return auth_render and methods_render and perms_render
-
-        else:
-            return True
-
     def render_to_response(self, context, **response_kwargs):
         if 'menu' in context:
-            for side in ['left', 'right']:
-                if side in context['menu']:
-                    for i, menu_item in enumerate(context['menu'][side]):
-                        if 'template_content' in menu_item:
-                            context['menu'][side][i]['label'] = Template(menu_item['template_content']).render(
-                                Context({**context, 'user': self.request.user, 'request': self.request}))
-                        else:
-                            context['menu'][side][i]['label'] = menu_item['name']
+            Menu.render_labels(context['menu'], Context({**context, 'user': self.request.user, 'request': self.request}))
 
         return super().render_to_response(context, **response_kwargs)
 
@@ -205,33 +79,43 @@ class SiteMixin:
 
     def get_site_context(self):
         if self.site_name:
-            site_context = {}
-            site = models.Site.get_populated_site(self.site_name, self.site_texts, self.site_images, self.site_paragraph_lists, True)
-
-            texts_list = site.texts.values_list('key', 'text')
-            images_list = site.images.values_list('key', 'image')
-            paragraphs_lists = [(para_list, para_list.paragraphs.all()) for para_list in site.paragraph_lists.all()]
-            site_context.update({
-                'texts': {key_text_pair[0]: key_text_pair[1] for key_text_pair in texts_list},
-                'images': {key_image_pair[0]: key_image_pair[1] for key_image_pair in images_list},
-                'lists': {
-                    key_list_pair[0].key: [
-                        {
-                            'order_num': para.order_num,
-                            'title': para.title,
-                            'text': para.text,
-                            'image': para.image
-                        } for para in key_list_pair[1].order_by(
-                            ('' if key_list_pair[0].ascending_order else '-') + 'order_num'
-                        )
-                    ] for key_list_pair in paragraphs_lists
-                }
-            })
-
-            return site_context
+            return models.Site.get_cached_site_content(self.site_name)
         else:
             return {}
 
+    @staticmethod
+    def get_site_definitions(url_patterns=None):
+        """
+        Collects the site content used by all views in the url configuration, including content set with as_view.
+        :return: Dict from site name to a (texts, images, paragraph_lists) tuple of lists of keys.
+        """
+        if url_patterns is None:
+            url_patterns = get_resolver().url_patterns
+
+        site_definitions = {}
+        for pattern in url_patterns:
+            if isinstance(pattern, URLResolver):
+                definitions = SiteMixin.get_site_definitions(pattern.url_patterns)
+            else:
+                view_class = getattr(pattern.callback, 'view_class', None)
+                if view_class is None or not issubclass(view_class, SiteMixin):
+                    continue
+                initkwargs = getattr(pattern.callback, 'view_initkwargs', {})
+                site_name = initkwargs.get('site_name', view_class.site_name)
+                if not site_name:
+                    continue
+                definitions = {site_name: tuple(
+                    initkwargs.get(attribute, getattr(view_class, attribute))
+                    for attribute in ['site_texts', 'site_images', 'site_paragraph_lists']
+                )}
+
+            for site_name, definition in definitions.items():
+                site_definitions[site_name] = tuple(
+                    keys + [key for key in new_keys if key not in keys]
+                    for keys, new_keys in zip(site_definitions.get(site_name, ([], [], [])), definition)
+                )
+        return site_definitions
+
     def get_context_data(self, **kwargs):
         super_context = super().get_context_data(**kwargs)
         super_context.update({
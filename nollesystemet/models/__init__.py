@@ -6,3 +6,4 @@ from .site import *
 from .settings import *
 from .feedback import *
 from .campussafari import *
+from .payment import *
@@ -1,12 +1,32 @@
 from django.apps import apps
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 from multiselectfield import MultiSelectField
 
 import authentication.models as auth_models
+from authentication.utils import get_cache_version, bump_cache_version
+from nollesystemet.exports import bump_export_data_version, HAPPENING_EXPORT_SCOPE
+from nollesystemet.menu import bump_menu_data_version
 from .user import UserProfile, NolleGroup
-from .misc import IntegerChoices, validate_no_emoji
+from .misc import IntegerChoices, validate_no_emoji, multiselect_contains
+
+
+HAPPENING_STATISTICS_VERSION_CACHE_KEY = 'nollesystemet:happening_statistics_version:%s'
+HAPPENING_STATISTICS_CACHE_TIMEOUT = 60 * 60
+
+
+def get_happening_statistics_version(happening_pk=None):
+    """ Returns the current version of the statistics of the happening, or of all happenings if happening_pk is None. """
+    return get_cache_version(HAPPENING_STATISTICS_VERSION_CACHE_KEY % ('all' if happening_pk is None else happening_pk))
+
+
+def bump_happening_statistics_version(happening_pk=None):
+    """ Invalidates the cached statistics of the happening, or of all happenings if happening_pk is None. """
+    bump_cache_version(HAPPENING_STATISTICS_VERSION_CACHE_KEY % ('all' if happening_pk is None else happening_pk))
 
 
 def _is_editor_condition():
@@ -16,6 +36,81 @@ def _is_not_nollan():
     return ~models.Q(user_type=UserProfile.UserType.NOLLAN)
 
 
+class HappeningQuerySet(models.QuerySet):
+    """ QuerySet expressing the visibility and registration rules of Happening in SQL. """
+
+    def published(self):
+        return self.filter(status__in=[Happening.HappeningStatus.PUBLISHED,
+                                       Happening.HappeningStatus.OPEN,
+                                       Happening.HappeningStatus.CLOSED])
+
+    def open_for_registration(self):
+        return self.filter(takes_registration=True, status=Happening.HappeningStatus.OPEN)
+
+    def attendable_by(self, user_profile: UserProfile):
+        """ Database side equivalent of Happening.can_attend. """
+        exclusive_access = Happening.exclusive_access.through.objects.filter(
+            happening=models.OuterRef('pk'), userprofile=user_profile.pk
+        )
+        num_of_groups = Happening.nolle_groups.through.objects.filter(
+            happening=models.OuterRef('pk')
+        ).order_by().values('happening').annotate(count=models.Count('pk')).values('count')
+
+        in_welcome_group = Happening.nolle_groups.through.objects.filter(
+            happening=models.OuterRef('pk'), nollegroup=user_profile.nolle_group_id
+        )
+
+        return self.annotate(
+            has_exclusive_access=models.Exists(exclusive_access),
+            in_welcome_group=models.Exists(in_welcome_group),
+            num_of_welcome_groups=Coalesce(models.Subquery(num_of_groups), 0),
+        ).filter(
+            models.Q(has_exclusive_access=True) |
+            (multiselect_contains('user_types', user_profile.user_type) &
+             (models.Q(in_welcome_group=True) | models.Q(num_of_welcome_groups=NolleGroup.objects.count())))
+        )
+
+    def visible_to(self, user_profile: UserProfile):
+        """ Database side equivalent of Happening.is_visible_to. """
+        return self.published().attendable_by(user_profile)
+
+    def registrable_by(self, user_profile: UserProfile):
+        """ Database side equivalent of Happening.can_register. """
+        return self.open_for_registration().attendable_by(user_profile)
+
+    def editable_by(self, observing_user: UserProfile):
+        """ Database side equivalent of Happening.can_edit. """
+        if observing_user.has_perm('nollesystemet.edit_happening'):
+            return self.all()
+        return self.filter(editors=observing_user)
+
+    def registered_visible_to(self, observing_user: UserProfile):
+        """ Database side equivalent of Happening.can_see_registered. """
+        if observing_user.has_perm('nollesystemet.see_registration') or \
+                observing_user.has_perm('nollesystemet.edit_registration'):
+            return self.all()
+        return self.editable_by(observing_user)
+
+    def with_user_info(self, user_profile: UserProfile):
+        """
+        Annotates the base price for the user type of user_profile as 'user_base_price' and prefetches the
+        registration of user_profile (if any) to the list 'user_registrations'.
+        """
+        registration_model = apps.get_model('nollesystemet.Registration')
+        return self.annotate(
+            user_base_price=UserTypeBasePrice.price_subquery(user_profile.user_type)
+        ).prefetch_related(
+            'usertypebaseprice_set',
+            models.Prefetch(
+                'registration_set',
+                queryset=registration_model.objects.filter(user=user_profile).with_prices()
+                                                   .select_related('user', 'drink_option')
+                                                   .prefetch_related('extra_option'),
+                to_attr='user_registrations'
+            )
+        )
+
+
 class Happening(models.Model):
     """
     Model representing a physical (or digital) event.
@@ -60,6 +155,14 @@ class Happening(models.Model):
     exclusive_access = models.ManyToManyField(UserProfile, blank=True, limit_choices_to=_is_not_nollan,
                                               related_name='exclusive_access_happenings')
 
+    # Denormalized counts of registrations, kept up to date by update_counters. None until first computed.
+    registered_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    confirmed_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    paid_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    attended_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    objects = HappeningQuerySet.as_manager()
+
     class Meta(auth_models.UserProfile.Meta):
         permissions = [
             ("create_happening", "Can create happenings"),
@@ -82,7 +185,7 @@ class Happening(models.Model):
 
     @staticmethod
     def user_is_editor(observing_user: UserProfile):
-        return len([True for happening in Happening.objects.all() if observing_user in happening.editors.all()]) > 0
+        return Happening.objects.filter(editors=observing_user).exists()
 
     def can_attend(self, observing_user: UserProfile):
         return self.has_exclusive_access(observing_user) or \
@@ -101,8 +204,7 @@ class Happening(models.Model):
 
     @staticmethod
     def can_register_to_some(observing_user: UserProfile):
-        return len([True for happening in Happening.objects.all()
-                    if happening.can_register(observing_user)]) > 0
+        return Happening.objects.registrable_by(observing_user).exists()
 
     def can_see_registered(self, observing_user: UserProfile):
         return self.can_edit(observing_user) or \
@@ -111,21 +213,98 @@ class Happening(models.Model):
 
     @staticmethod
     def can_see_some_registered(observing_user: UserProfile):
-        return len([True for happening in Happening.objects.all()
-                    if happening.can_see_registered(observing_user)]) > 0
+        return Happening.objects.registered_visible_to(observing_user).exists()
 
     def can_edit(self, observing_user: UserProfile):
         return observing_user in self.editors.all() or observing_user.has_perm('nollesystemet.edit_happening')
 
     @staticmethod
     def can_edit_some_registered(observing_user: UserProfile):
-        return len([True for happening in Happening.objects.all()
-                    if happening.can_edit(observing_user)]) > 0
+        return Happening.objects.editable_by(observing_user).exists()
 
     @property
     def num_of_registered(self):
+        if self.registered_count is not None:
+            return self.registered_count
         return self.registration_set.count()
 
+    COUNTER_FIELDS = ['registered_count', 'confirmed_count', 'paid_count', 'attended_count']
+
+    @staticmethod
+    def get_counter_aggregates():
+        """ :return Dict of the aggregates computing the registration counts, keyed by COUNTER_FIELDS. """
+        return {
+            'registered_count': models.Count('pk'),
+            'confirmed_count': models.Count('pk', filter=models.Q(confirmed=True)),
+            'paid_count': models.Count('pk', filter=models.Q(paid=True)),
+            'attended_count': models.Count('pk', filter=models.Q(attended=True)),
+        }
+
+    @staticmethod
+    def update_counters(happening_pks):
+        """
+        Recomputes the denormalized registration counts of the happenings with the given primary keys, and invalidates
+        their cached statistics and exports once the transaction is committed.
+        """
+        happening_pks = set(happening_pks)
+        if not happening_pks:
+            return
+        # Counted and written in one statement, so that concurrent updates can not overwrite a newer count
+        registration_model = apps.get_model('nollesystemet.Registration')
+        registrations = registration_model.objects.filter(happening=models.OuterRef('pk')).values('happening')
+        Happening.objects.filter(pk__in=happening_pks).update(**{
+            field: Coalesce(models.Subquery(registrations.annotate(count=aggregate).values('count'),
+                                            output_field=models.IntegerField()), 0)
+            for field, aggregate in Happening.get_counter_aggregates().items()
+        })
+
+        def invalidate():
+            for happening_pk in happening_pks:
+                bump_happening_statistics_version(happening_pk)
+                bump_export_data_version(HAPPENING_EXPORT_SCOPE % happening_pk)
+        # Not before commit, or other requests could cache statistics and exports of the old data under the new version
+        transaction.on_commit(invalidate)
+
+    def get_statistics(self):
+        """
+        :return Dict with the registration counts (COUNTER_FIELDS) of the happening in total ('total'), per nØllegrupp
+        ('per_group') and per user type ('per_user_type'). The counts are computed with one aggregate query.
+        """
+        registration_model = apps.get_model('nollesystemet.Registration')
+        rows = registration_model.objects.filter(happening=self).values('user__nolle_group', 'user__user_type')\
+                                         .annotate(**Happening.get_counter_aggregates()).order_by()
+
+        def empty_counts():
+            return {field: 0 for field in Happening.COUNTER_FIELDS}
+
+        total = empty_counts()
+        per_group = {group.pk: dict(group_id=group.pk, group=group.name, **empty_counts())
+                     for group in NolleGroup.objects.only('pk', 'name')}
+        per_user_type = {user_type.value: dict(user_type=user_type.value, label=str(user_type.label), **empty_counts())
+                         for user_type in UserProfile.UserType}
+        for row in rows:
+            for counts in [total, per_group.get(row['user__nolle_group']), per_user_type.get(row['user__user_type'])]:
+                if counts is not None:
+                    for field in Happening.COUNTER_FIELDS:
+                        counts[field] += row[field]
+
+        return {
+            'happening': self.pk,
+            'total': total,
+            'per_group': list(per_group.values()),
+            'per_user_type': list(per_user_type.values()),
+        }
+
+    def get_cached_statistics(self):
+        """ Same as get_statistics, but cached until the registrations to the happening change. """
+        key = 'nollesystemet:happening_statistics:%s:%s:%s' % (self.pk, get_happening_statistics_version(),
+                                                              get_happening_statistics_version(self.pk))
+        statistics = cache.get(key)
+        if statistics is None:
+            statistics = self.get_statistics()
+            cache.set(key, statistics, HAPPENING_STATISTICS_CACHE_TIMEOUT)
+        return statistics
+
     def is_published(self):
         return self.status in [Happening.HappeningStatus.PUBLISHED,
                                Happening.HappeningStatus.OPEN,
@@ -145,23 +324,21 @@ class Happening(models.Model):
 
     def get_baseprice(self, argument):
         if isinstance(argument, apps.get_model('nollesystemet.Registration')):
-            try:
-                return self.usertypebaseprice_set.get(user_type=argument.user.user_type).price
-            except UserTypeBasePrice.DoesNotExist:
-                all_prices = self.usertypebaseprice_set.all().order_by('price')
-                if len(all_prices) == 0:
-                    return 0
-                else:
-                    return all_prices[len(all_prices) - 1].price
+            user_type = argument.user.user_type
         elif isinstance(argument, apps.get_model('nollesystemet.UserProfile').UserType):
-            try:
-                return self.usertypebaseprice_set.get(user_type=argument).price
-            except UserTypeBasePrice.DoesNotExist:
-                all_prices = self.usertypebaseprice_set.all().order_by('price')
-                if len(all_prices) == 0:
-                    return 0
-                else:
-                    return all_prices[len(all_prices) - 1].price
+            user_type = argument
+        else:
+            return None
+
+        # Iterate in python to make use of prefetched base prices
+        all_prices = list(self.usertypebaseprice_set.all())
+        for base_price in all_prices:
+            if base_price.user_type == user_type:
+                return base_price.price
+        if len(all_prices) == 0:
+            return 0
+        else:
+            return max(base_price.price for base_price in all_prices)
 
 
 class UserTypeBasePrice(models.Model):
@@ -179,6 +356,19 @@ class UserTypeBasePrice(models.Model):
     def __str__(self):
         return "%s (+%d kr)" % (UserProfile.UserType(self.user_type).label, self.price)
 
+    @staticmethod
+    def price_subquery(user_type, happening_ref='pk'):
+        """
+        :return Expression evaluating to the base price of user_type at the happening referenced by happening_ref.
+        Falls back to the highest base price of the happening, or 0 if none exist (same as Happening.get_baseprice).
+        """
+        prices = UserTypeBasePrice.objects.filter(happening=models.OuterRef(happening_ref))
+        return Coalesce(
+            models.Subquery(prices.filter(user_type=user_type).values('price')[:1]),
+            models.Subquery(prices.order_by('-price').values('price')[:1]),
+            0
+        )
+
 
 class DrinkOption(models.Model):
     """ Model representing an option of drinks to a happening and its associated price. """
@@ -210,3 +400,24 @@ class ExtraOption(models.Model):
 
     def __str__(self):
         return "%s (+%d kr)" % (self.extra_option, self.price)
+
+
+@receiver(models.signals.m2m_changed, sender=Happening.editors.through)
+def invalidate_menus_editors(sender, action, *args, **kwargs):
+    """ Invalidates cached menus when the editors of a happening change. """
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        bump_menu_data_version()
+
+
+@receiver(models.signals.post_delete, sender=Happening)
+def invalidate_menus_happening_delete(sender, *args, **kwargs):
+    """ Invalidates cached menus when a happening (and thereby its editors) is deleted. """
+    bump_menu_data_version()
+
+
+@receiver(models.signals.post_save, sender=UserProfile)
+@receiver(models.signals.post_save, sender=NolleGroup)
+@receiver(models.signals.post_delete, sender=NolleGroup)
+def invalidate_happening_statistics(sender, *args, **kwargs):
+    """ Invalidates the cached statistics of all happenings, since they are grouped by nØllegrupp and user type. """
+    transaction.on_commit(bump_happening_statistics_version)
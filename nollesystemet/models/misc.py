@@ -5,6 +5,24 @@ from django.core.exceptions import ValidationError
 from django.db import models
 
 
+def multiselect_contains(field_name, value):
+    """ :return Q object matching rows where the MultiSelectField field_name has value selected. """
+    value = str(value)
+    return models.Q(**{field_name: value}) | \
+           models.Q(**{field_name + '__startswith': value + ','}) | \
+           models.Q(**{field_name + '__endswith': ',' + value}) | \
+           models.Q(**{field_name + '__contains': ',' + value + ','})
+
+
+def luhn_check_digit(number):
+    """ :return The Luhn (mod 10) check digit of the string of digits number. """
+    total = 0
+    for i, digit in enumerate(reversed(number)):
+        value = int(digit) * (2 if i % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return str((10 - total % 10) % 10)
+
+
 def validate_no_emoji(value):
     regex = re.compile(r'[^\u0000-\uFFFF]+')
     if regex.search(value):
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.dispatch import receiver
 
+from nollesystemet.exports import bump_export_data_version, NOLLE_FORM_EXPORT_SCOPE
 from .misc import validate_no_emoji
 from .user import UserProfile
 
@@ -178,3 +179,15 @@ def update_user_profile_from_nolleForm(sender, instance, *args, **kwargs):
         for field_name in common_fields:
             setattr(instance.user, field_name, getattr(instance, field_name))
         instance.user.save()
+
+
+@receiver(models.signals.post_save, sender=NolleFormAnswer)
+@receiver(models.signals.post_delete, sender=NolleFormAnswer)
+@receiver(models.signals.m2m_changed, sender=NolleFormAnswer.dynamic_answers.through)
+@receiver(models.signals.post_save, sender=DynamicNolleFormQuestion)
+@receiver(models.signals.post_delete, sender=DynamicNolleFormQuestion)
+@receiver(models.signals.post_save, sender=DynamicNolleFormQuestionAnswer)
+@receiver(models.signals.post_delete, sender=DynamicNolleFormQuestionAnswer)
+def invalidate_nolle_form_exports(sender, *args, **kwargs):
+    """ Invalidates the exports of the nØlleform answers once the transaction is committed. """
+    transaction.on_commit(lambda: bump_export_data_version(NOLLE_FORM_EXPORT_SCOPE))
@@ -0,0 +1,62 @@
+import hashlib
+
+from django.db import models
+
+from .misc import IntegerChoices
+from .user import UserProfile
+from .registration import Registration
+
+
+class PaymentTransaction(models.Model):
+    """
+    Model representing one imported row of a Swish or bankgiro statement. The content hash makes sure that every row
+    is only recorded once, however many times overlapping statements are uploaded. Rows without a final status are
+    reconciled again when uploaded again.
+    """
+
+    class Source(IntegerChoices):
+        SWISH = 1, "Swish"
+        BANKGIRO = 2, "Bankgiro"
+
+    class Status(IntegerChoices):
+        MATCHED = 1, "Registrerad"
+        ALREADY_PAID = 2, "Redan betald"
+        AMOUNT_MISMATCH = 3, "Fel belopp"
+        UNKNOWN_OCR = 4, "Okänt OCR-nummer"
+        INVALID = 5, "Oläslig rad"
+
+    # Statuses of rows that are skipped when imported again
+    FINAL_STATUSES = [Status.MATCHED, Status.ALREADY_PAID]
+
+    source = models.PositiveSmallIntegerField(choices=Source.choices, verbose_name="Källa")
+    content_hash = models.CharField(max_length=64, unique=True, editable=False)
+    row = models.TextField(blank=True, verbose_name="Rad")
+    OCR = models.CharField(max_length=100, blank=True, verbose_name="OCR")
+    amount = models.IntegerField(null=True, blank=True, verbose_name="Belopp")
+    status = models.PositiveSmallIntegerField(choices=Status.choices, verbose_name="Status")
+    registration = models.ForeignKey(Registration, null=True, blank=True, on_delete=models.SET_NULL,
+                                     related_name='payment_transactions', verbose_name="Anmälan")
+
+    imported_at = models.DateTimeField(auto_now_add=True, verbose_name="Inläst")
+    imported_by = models.ForeignKey(UserProfile, null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name='+', verbose_name="Inläst av")
+
+    class Meta:
+        verbose_name = 'Betalning'
+        verbose_name_plural = 'Betalningar'
+        ordering = ['-imported_at']
+
+    def __str__(self):
+        return "%s %s: %s kr (%s)" % (self.get_source_display(), self.OCR, self.amount, self.get_status_display())
+
+    @staticmethod
+    def row_to_text(row):
+        return ';'.join(str(cell).strip() for cell in row)
+
+    @staticmethod
+    def compute_hash(source, row_text, occurrence=0):
+        """
+        :return The content hash of a statement row. occurrence tells how many identical rows preceded the row in the
+        statement, so that identical payments within a statement are kept apart.
+        """
+        return hashlib.sha256(('%d\n%d\n%s' % (source, occurrence, row_text)).encode('utf-8')).hexdigest()
@@ -2,16 +2,86 @@ import random
 
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
 from django.template.loader import get_template
 from django.template import engines
 
-from .misc import validate_no_emoji
-from .happening import Happening, DrinkOption, ExtraOption
-from .user import UserProfile
+from nollesystemet.exports import bump_export_data_version, HAPPENING_EXPORT_SCOPE
+from .misc import validate_no_emoji, luhn_check_digit
+from .happening import Happening, DrinkOption, ExtraOption, UserTypeBasePrice
+from .user import UserProfile, NolleGroup
 from .settings import HappeningSettings
 
 
+class RegistrationQuerySet(models.QuerySet):
+    """ QuerySet with database side equivalents of the per-object permission methods of Registration. """
+
+    def visible_to(self, observing_user: UserProfile):
+        """ :return The registrations observing_user can see (Registration.can_see). """
+        if observing_user.has_perm('nollesystemet.edit_registration') or \
+                observing_user.has_perm('nollesystemet.edit_happening'):
+            return self.all()
+
+        condition = models.Q(user=observing_user) | models.Exists(
+            Happening.editors.through.objects.filter(happening=models.OuterRef('happening'),
+                                                     userprofile=observing_user.pk)
+        )
+        if NolleGroup.is_forfadder(observing_user):
+            condition |= models.Exists(
+                NolleGroup.forfadders.through.objects.filter(nollegroup=models.OuterRef('user__nolle_group'),
+                                                             userprofile=observing_user.pk)
+            )
+        return self.filter(condition)
+
+    def editable_by(self, observing_user: UserProfile):
+        """ :return The registrations observing_user can edit (Registration.can_edit). """
+        if observing_user.has_perm('nollesystemet.edit_registration') or \
+                observing_user.has_perm('nollesystemet.edit_happening'):
+            return self.all()
+        return self.filter(happening__editors=observing_user)
+
+    def with_prices(self):
+        """
+        Annotates the price components of Registration (base_price, drink_price, extra_option_price, pre_paid_price and
+        on_site_paid_price) computed in the database, as 'annotated_<name>'. The price properties of the returned
+        registrations use the annotations instead of querying.
+        """
+        price_field = models.IntegerField()
+        base_price = UserTypeBasePrice.price_subquery(models.OuterRef('user__user_type'), happening_ref='happening')
+        drink_price = Coalesce(models.F('drink_option__price'), 0, output_field=price_field)
+        extra_option_price = Coalesce(models.Subquery(
+            Registration.extra_option.through.objects.filter(registration=models.OuterRef('pk'))
+                .values('registration').annotate(total=models.Sum('extraoption__price')).values('total')[:1]
+        ), 0, output_field=price_field)
+
+        def if_included(field, price):
+            return models.Case(models.When(**{field: True, 'then': price}), default=0, output_field=price_field)
+
+        def unless_included(field, price):
+            return models.Case(models.When(**{field: True, 'then': 0}), default=price, output_field=price_field)
+
+        return self.annotate(
+            annotated_base_price=base_price,
+            annotated_drink_price=drink_price,
+            annotated_extra_option_price=extra_option_price,
+        ).annotate(
+            annotated_pre_paid_price=models.ExpressionWrapper(
+                models.F('annotated_base_price') +
+                if_included('happening__include_drink_in_price', models.F('annotated_drink_price')) +
+                if_included('happening__include_extra_in_price', models.F('annotated_extra_option_price')),
+                output_field=price_field
+            ),
+            annotated_on_site_paid_price=models.Case(
+                models.When(happening__include_drink_in_price=True, happening__include_extra_in_price=True, then=None),
+                default=unless_included('happening__include_drink_in_price', models.F('annotated_drink_price')) +
+                unless_included('happening__include_extra_in_price', models.F('annotated_extra_option_price')),
+                output_field=price_field
+            ),
+        )
+
+
 class Registration(models.Model):
     """ Model representing a registration of a user to a happening. Contains information on options and alike. """
 
@@ -27,9 +97,19 @@ class Registration(models.Model):
 
     confirmed = models.BooleanField(editable=False, default=False)
     paid = models.BooleanField(editable=False, default=False)
-    OCR = models.CharField(max_length=6, editable=False, blank=False, null=False)
+    OCR = models.CharField(max_length=6, editable=False, blank=False, null=False, unique=True)
     attended = models.BooleanField(editable=False, default=False)
 
+    # Denormalized prices, kept up to date by update_denormalized_prices. None until first computed.
+    pre_paid_total = models.IntegerField(null=True, blank=True, editable=False)
+    on_site_total = models.IntegerField(null=True, blank=True, editable=False)
+
+    # Extra options about to be saved (e.g. by RegistrationForm), which the prices are computed from instead of the
+    # saved ones. The m2m_changed handler does not reprice registrations with pending extra options.
+    pending_extra_options = None
+
+    objects = RegistrationQuerySet.as_manager()
+
     class Meta:
         permissions = [
             ("see_registration", "Can see any registration"),
@@ -59,9 +139,8 @@ class Registration(models.Model):
     @staticmethod
     def can_see_some(observing_user: UserProfile):
         """ :return Boolean indicating if observing_user has the right to see the registration of some user. """
-        # If can see more than one user. Larger than 1 because all users can see their own profile
-        return len([True for registration in Registration.objects.all() if registration.can_see(observing_user)]) > \
-               len(Registration.objects.filter(user=observing_user))
+        # If can see some registration other than their own, since all users can see their own registrations
+        return Registration.objects.visible_to(observing_user).exclude(user=observing_user).exists()
 
     def can_edit(self, observing_user: UserProfile):
         if observing_user.has_perm('nollesystemet.edit_registration'):
@@ -72,17 +151,86 @@ class Registration(models.Model):
 
     @staticmethod
     def can_edit_some(observing_user: UserProfile):
-        """ :return Boolean indicating if observing_user has the right to see the registration of some user. """
-        # If can see more than one user. Larger than 1 because all users can see their own profile
-        return len([True for registration in Registration.objects.all()
-                    if registration.can_edit(observing_user)]) > 0
+        """ :return Boolean indicating if observing_user has the right to edit the registration of some user. """
+        return Registration.objects.editable_by(observing_user).exists()
+
+    # What the properties need to be read without querying, see DownloadView.get_accessor_dependencies
+    PROPERTY_DEPENDENCIES = {
+        'base_price': {'queryset_methods': ['with_prices']},
+        'drink_price': {'queryset_methods': ['with_prices']},
+        'extra_option_price': {'queryset_methods': ['with_prices']},
+        'pre_paid_price': {'queryset_methods': ['with_prices']},
+        'on_site_paid_price': {'queryset_methods': ['with_prices']},
+        'all_extra_options_str': {'prefetch_related': ['extra_option']},
+    }
+
+    PRICE_ANNOTATIONS = ['annotated_base_price', 'annotated_drink_price', 'annotated_extra_option_price',
+                         'annotated_pre_paid_price', 'annotated_on_site_paid_price']
+
+    def clear_annotated_prices(self):
+        """ Makes the price properties compute the prices again, e.g. after the options have been changed. """
+        for annotation in Registration.PRICE_ANNOTATIONS:
+            self.__dict__.pop(annotation, None)
+        self.pre_paid_total = None
+        self.on_site_total = None
+
+    def update_prices(self):
+        """
+        Sets pre_paid_total and on_site_total from the current options, without saving. Registrations that are free
+        are marked as paid.
+        """
+        self.clear_annotated_prices()
+        base_price, drink_price, extra_option_price = self.base_price, self.drink_price, self.extra_option_price
+        include_drink, include_extra = self.happening.include_drink_in_price, self.happening.include_extra_in_price
+
+        self.pre_paid_total = base_price + (drink_price if include_drink else 0) + \
+                              (extra_option_price if include_extra else 0)
+        if include_drink and include_extra:
+            self.on_site_total = None
+        else:
+            self.on_site_total = (0 if include_drink else drink_price) + (0 if include_extra else extra_option_price)
+
+        if self.pre_paid_total == 0:
+            self.paid = True
+
+    @staticmethod
+    def update_denormalized_prices(queryset, mark_free_as_paid=False):
+        """
+        Recomputes pre_paid_total and on_site_total of the registrations in queryset.
+        :param mark_free_as_paid: Also mark the registrations with pre paid price 0 as paid, like save does.
+        :return Dict from primary key to the tuple (pre_paid_total, on_site_total) of the updated registrations.
+        """
+        totals = {
+            pk: (pre_paid_price, on_site_paid_price) for pk, pre_paid_price, on_site_paid_price in
+            queryset.with_prices().values_list('pk', 'annotated_pre_paid_price', 'annotated_on_site_paid_price')
+        }
+        Registration.objects.bulk_update(
+            [Registration(pk=pk, pre_paid_total=pre_paid_total, on_site_total=on_site_total)
+             for pk, (pre_paid_total, on_site_total) in totals.items()],
+            ['pre_paid_total', 'on_site_total'], batch_size=500
+        )
+
+        if mark_free_as_paid:
+            free_registrations = Registration.objects.filter(
+                pk__in=[pk for pk, (pre_paid_total, _) in totals.items() if pre_paid_total == 0], paid=False
+            )
+            happening_pks = set(free_registrations.values_list('happening', flat=True))
+            if happening_pks:
+                free_registrations.update(paid=True)
+                Happening.update_counters(happening_pks)
+
+        return totals
 
     @property
     def base_price(self):
+        if 'annotated_base_price' in self.__dict__:
+            return self.annotated_base_price
         return self.happening.get_baseprice(self)
 
     @property
     def drink_price(self):
+        if 'annotated_drink_price' in self.__dict__:
+            return self.annotated_drink_price
         if self.drink_option:
             return self.drink_option.price
         else:
@@ -90,10 +238,20 @@ class Registration(models.Model):
 
     @property
     def extra_option_price(self):
-        return sum([values['price'] for values in self.extra_option.values('price')])
+        if 'annotated_extra_option_price' in self.__dict__:
+            return self.annotated_extra_option_price
+        if self.pending_extra_options is not None:
+            return sum([extra_option.price for extra_option in self.pending_extra_options])
+        if self.pk is None:
+            return 0
+        return sum([extra_option.price for extra_option in self.extra_option.all()])
 
     @property
     def pre_paid_price(self):
+        if 'annotated_pre_paid_price' in self.__dict__:
+            return self.annotated_pre_paid_price
+        if self.pre_paid_total is not None:
+            return self.pre_paid_total
         if self.happening.include_drink_in_price:
             if self.happening.include_extra_in_price:
                 return self.base_price + self.extra_option_price + self.drink_price
@@ -107,6 +265,10 @@ class Registration(models.Model):
 
     @property
     def on_site_paid_price(self):
+        if 'annotated_on_site_paid_price' in self.__dict__:
+            return self.annotated_on_site_paid_price
+        if self.pre_paid_total is not None:
+            return self.on_site_total
         if self.happening.include_drink_in_price:
             if self.happening.include_extra_in_price:
                 return None
@@ -124,8 +286,6 @@ class Registration(models.Model):
 
     def send_confirmation_email(self):
         """ (!) Only call this post save to db. """
-        self.save()
-
         subject_template = get_template('fadderiet/evenemang/bekraftelse_epost_amne.txt')
         plaintext = get_template('fadderiet/evenemang/bekraftelse_epost.txt')
         html = get_template('fadderiet/evenemang/bekraftelse_epost.html')
@@ -156,29 +316,144 @@ class Registration(models.Model):
         res = msg.send()
         if res == 1:
             self.confirmed = True
-            self.save()
+            self.save(update_fields=['confirmed', 'updated_at'])
             return True
         else:
             return False
 
+    OCR_ALLOCATION_ATTEMPTS = 100
+
+    # Fields the prices depend on, apart from the extra options
+    PRICE_DEPENDENCIES = ['happening', 'user', 'drink_option']
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        """
+        Computes the prices and paid state before writing, so that the registration is written in one statement.
+        Saves that only update fields the prices do not depend on leave the prices as they are.
+        """
+        if update_fields is None or not set(update_fields).isdisjoint(Registration.PRICE_DEPENDENCIES):
+            self.update_prices()
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'pre_paid_total', 'on_site_total', 'paid'}
+
         if not self.OCR:
-            self.OCR = self._generate_OCR()
+            self._save_with_new_OCR(force_insert, force_update, using, update_fields)
+        else:
+            super().save(force_insert, force_update, using, update_fields)
 
-        super().save(force_insert, force_update, using, update_fields)
+    def _save_with_new_OCR(self, force_insert, force_update, using, update_fields):
+        """ Saves with random OCR numbers until one not taken is found. Uniqueness is enforced by the database. """
+        for attempt in range(Registration.OCR_ALLOCATION_ATTEMPTS):
+            self.OCR = self._generate_OCR()
+            try:
+                with transaction.atomic(using=using):
+                    super().save(force_insert, force_update, using, update_fields)
+                return
+            except IntegrityError:
+                if not Registration.objects.using(using).filter(OCR=self.OCR).exists():
+                    raise
+        self.OCR = ''
+        raise IntegrityError("No free OCR number found in %d attempts." % Registration.OCR_ALLOCATION_ATTEMPTS)
 
-        if self.pre_paid_price == 0:
-            self.paid = True
-            super().save(force_insert, force_update, using, update_fields)
-        
     @staticmethod
     def _generate_OCR():
-        candidate_OCR = None
-        existing_OCRs = Registration.objects.values_list('OCR', flat=True)
-
-        while candidate_OCR is None or candidate_OCR in existing_OCRs:
-            candidate_OCR = random.randint(settings.OCR_NUMBER_LOW, settings.OCR_NUMBER_HIGH)
+        """
+        :return A random OCR number. If settings.OCR_CHECK_DIGIT is set, the last digit is a Luhn check digit, which
+        makes it possible to reject most mistyped OCR numbers without looking them up.
+        """
+        if getattr(settings, 'OCR_CHECK_DIGIT', False):
+            format_string = '%0' + str(settings.OCR_NUMBER_NUM_DIGITS - 1) + 'd'
+            number = format_string % random.randint(settings.OCR_NUMBER_LOW // 10, settings.OCR_NUMBER_HIGH // 10)
+            return number + luhn_check_digit(number)
 
         format_string = '%0' + str(settings.OCR_NUMBER_NUM_DIGITS) + 'd'
-        return format_string % candidate_OCR
+        return format_string % random.randint(settings.OCR_NUMBER_LOW, settings.OCR_NUMBER_HIGH)
 
+    @staticmethod
+    def is_valid_OCR(OCR):
+        """ :return Boolean indicating if OCR is on the format of generated OCR numbers (including check digit). """
+        if len(OCR) != settings.OCR_NUMBER_NUM_DIGITS or not OCR.isdigit():
+            return False
+        if getattr(settings, 'OCR_CHECK_DIGIT', False):
+            return luhn_check_digit(OCR[:-1]) == OCR[-1]
+        return True
+
+
+@receiver(models.signals.post_save, sender=Registration)
+def update_counters_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ Updates the registration counts of the happening once the transaction is committed. """
+    if raw or (update_fields is not None and
+               set(update_fields).isdisjoint(['happening', 'confirmed', 'paid', 'attended'])):
+        return
+    happening_pk = instance.happening_id
+    transaction.on_commit(lambda: Happening.update_counters([happening_pk]))
+
+
+@receiver(models.signals.post_delete, sender=Registration)
+def update_counters_on_delete(sender, instance, **kwargs):
+    happening_pk = instance.happening_id
+    transaction.on_commit(lambda: Happening.update_counters([happening_pk]))
+
+
+@receiver(models.signals.m2m_changed, sender=Registration.extra_option.through)
+def update_denormalized_extra_options(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Reprices registrations whose extra options changed once the transaction is committed. Registrations saved with
+    pending_extra_options were already priced with them by save.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        if instance.pending_extra_options is not None:
+            return
+        registrations = Registration.objects.filter(pk=instance.pk)
+    elif pk_set:
+        registrations = Registration.objects.filter(pk__in=pk_set)
+    else:
+        registrations = Registration.objects.filter(happening=instance.happening_id)
+    transaction.on_commit(lambda: Registration.update_denormalized_prices(registrations, mark_free_as_paid=True))
+
+
+@receiver(models.signals.post_save, sender=Happening)
+@receiver(models.signals.post_save, sender=DrinkOption)
+@receiver(models.signals.post_save, sender=ExtraOption)
+@receiver(models.signals.post_save, sender=UserTypeBasePrice)
+@receiver(models.signals.post_delete, sender=DrinkOption)
+@receiver(models.signals.post_delete, sender=ExtraOption)
+@receiver(models.signals.post_delete, sender=UserTypeBasePrice)
+def update_denormalized_happening_prices(sender, instance, raw=False, **kwargs):
+    """ Updates the denormalized prices of all registrations to a happening when its prices change. """
+    if raw:
+        return
+    happening_pk = instance.pk if sender is Happening else instance.happening_id
+    Registration.update_denormalized_prices(Registration.objects.filter(happening=happening_pk))
+
+
+@receiver(models.signals.post_save, sender=UserProfile)
+def update_denormalized_user_prices(sender, instance, raw=False, **kwargs):
+    """ Updates the denormalized prices of the registrations of a user, since the base price depends on user type. """
+    if raw:
+        return
+    Registration.update_denormalized_prices(Registration.objects.filter(user=instance))
+
+
+@receiver(models.signals.post_save, sender=Registration)
+@receiver(models.signals.post_delete, sender=Registration)
+@receiver(models.signals.post_save, sender=Happening)
+@receiver(models.signals.post_save, sender=DrinkOption)
+@receiver(models.signals.post_save, sender=ExtraOption)
+@receiver(models.signals.post_save, sender=UserTypeBasePrice)
+@receiver(models.signals.post_delete, sender=DrinkOption)
+@receiver(models.signals.post_delete, sender=ExtraOption)
+@receiver(models.signals.post_delete, sender=UserTypeBasePrice)
+def invalidate_happening_exports(sender, instance, **kwargs):
+    """ Invalidates the exports of a happening once the transaction is committed, so they are not rebuilt early. """
+    scope = HAPPENING_EXPORT_SCOPE % (instance.pk if sender is Happening else instance.happening_id)
+    transaction.on_commit(lambda: bump_export_data_version(scope))
+
+
+@receiver(models.signals.m2m_changed, sender=Registration.extra_option.through)
+def invalidate_happening_exports_extra_options(sender, instance, action, reverse, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        scope = HAPPENING_EXPORT_SCOPE % instance.happening_id
+        transaction.on_commit(lambda: bump_export_data_version(scope))
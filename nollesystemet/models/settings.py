@@ -1,8 +1,15 @@
-from django.core.cache import cache
-from django.db import models
+from django.db import models, transaction
+
+from authentication.utils import get_cache_version, bump_cache_version
 
 
 class SingeltonModel(models.Model):
+    """
+    Model with a single instance. Loaded instances are kept in each process and reused as long as the version of the
+    model in the (shared) cache is unchanged. Saving bumps the version, which makes all processes reload the instance.
+    """
+    _loaded_instances = {}
+
     class Meta:
         abstract = True
 
@@ -14,16 +21,33 @@ class SingeltonModel(models.Model):
     def delete(self, *args, **kwargs):
         pass
 
+    @classmethod
+    def get_version_cache_key(cls):
+        return 'nollesystemet:singelton_version:%s' % cls.__name__
+
+    @classmethod
+    def get_version(cls):
+        return get_cache_version(cls.get_version_cache_key())
+
+    @classmethod
+    def bump_version(cls):
+        bump_cache_version(cls.get_version_cache_key())
+
     @classmethod
     def load(cls):
-        if cache.get(cls.__name__) is None:
-            obj, created = cls.objects.get_or_create(pk=1)
-            if not created:
-                obj.set_cache()
-        return cache.get(cls.__name__)
+        # The version is read before the database so that a concurrent save always leads to a reload
+        version = cls.get_version()
+        loaded = cls._loaded_instances.get(cls)
+        if loaded is not None and loaded[0] == version:
+            return loaded[1]
+
+        obj, created = cls.objects.get_or_create(pk=1)
+        cls._loaded_instances[cls] = (version, obj)
+        return obj
 
     def set_cache(self):
-        cache.set(self.__class__.__name__, self)
+        self._loaded_instances.pop(self.__class__, None)
+        transaction.on_commit(self.bump_version)
 
     def __str__(self):
         if hasattr(self._meta, 'verbose_name'):
@@ -1,12 +1,29 @@
+import hashlib
 from keyword import iskeyword
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
+from authentication.utils import get_cache_version, bump_cache_version
 from .misc import validate_no_emoji
 
+SITE_CONTENT_VERSION_CACHE_KEY = 'nollesystemet:site_content_version'
+SITE_CONTENT_CACHE_TIMEOUT = 6 * 60 * 60
+
+
+def get_site_content_version():
+    """ Returns the current version of the content of all sites. """
+    return get_cache_version(SITE_CONTENT_VERSION_CACHE_KEY)
+
+
+def bump_site_content_version():
+    """ Invalidates the cached content of all sites. """
+    bump_cache_version(SITE_CONTENT_VERSION_CACHE_KEY)
+
 
 class Site(models.Model):
     """ Model representing a site and its content such as texts and images. """
@@ -101,6 +118,54 @@ class Site(models.Model):
 
         return site
 
+    @staticmethod
+    def sync_sites(site_definitions, clear_redundant=True):
+        """
+        Creates (and if clear_redundant removes) the texts, images and paragraph lists of all sites in
+        site_definitions, a dict from site name to a (texts, images, paragraph_lists) tuple of keys.
+        """
+        with transaction.atomic():
+            for site_name, (texts, images, paragraph_lists) in site_definitions.items():
+                Site.get_populated_site(site_name, texts, images, paragraph_lists, clear_redundant)
+
+    @staticmethod
+    def get_site_content(site_name):
+        """
+        Read-only lookup of the content of a site, as used in the site context of views.
+        Content is created by sync_sites, keys not yet created are simply missing.
+        :return: Dict with the texts and images by key and the ordered paragraphs of the paragraph lists by key.
+        """
+        texts = dict(SiteText.objects.filter(site__name=site_name).values_list('key', 'text'))
+        images = dict(SiteImage.objects.filter(site__name=site_name).values_list('key', 'image'))
+        paragraph_lists = SiteParagraphList.objects.filter(site__name=site_name).prefetch_related('paragraphs')
+
+        return {
+            'texts': texts,
+            'images': images,
+            'lists': {
+                para_list.key: [
+                    {
+                        'order_num': para.order_num,
+                        'title': para.title,
+                        'text': para.text,
+                        'image': para.image
+                    } for para in sorted(para_list.paragraphs.all(), key=lambda para: para.order_num,
+                                         reverse=not para_list.ascending_order)
+                ] for para_list in paragraph_lists
+            }
+        }
+
+    @staticmethod
+    def get_cached_site_content(site_name):
+        """ Same as get_site_content, but cached until the content of some site changes, or at most a few hours. """
+        key = 'nollesystemet:site_content:%s:%s' % (get_site_content_version(),
+                                                    hashlib.md5(site_name.encode('utf-8')).hexdigest())
+        content = cache.get(key)
+        if content is None:
+            content = Site.get_site_content(site_name)
+            cache.set(key, content, SITE_CONTENT_CACHE_TIMEOUT)
+        return content
+
     def __str__(self):
         return self.name
 
@@ -184,3 +249,18 @@ class SiteParagraph(models.Model):
     def __str__(self):
         return '%s: %s: %d' % (self.paragraph_list.site.name, self.paragraph_list.key, self.order_num)
 
+
+
+@receiver(models.signals.post_save, sender=Site)
+@receiver(models.signals.post_save, sender=SiteText)
+@receiver(models.signals.post_save, sender=SiteImage)
+@receiver(models.signals.post_save, sender=SiteParagraphList)
+@receiver(models.signals.post_save, sender=SiteParagraph)
+@receiver(models.signals.post_delete, sender=Site)
+@receiver(models.signals.post_delete, sender=SiteText)
+@receiver(models.signals.post_delete, sender=SiteImage)
+@receiver(models.signals.post_delete, sender=SiteParagraphList)
+@receiver(models.signals.post_delete, sender=SiteParagraph)
+def invalidate_site_content(sender, *args, **kwargs):
+    """ Invalidates the cached site content once the changed content is committed. """
+    transaction.on_commit(bump_site_content_version)
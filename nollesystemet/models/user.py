@@ -1,11 +1,15 @@
 from django.apps import apps
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
 import authentication.models as auth_models
+from authentication.hashers import make_passwords
+from authentication.permissions import get_permission_snapshot
+from nollesystemet.exports import bump_export_data_version, USERS_EXPORT_SCOPE
+from nollesystemet.menu import bump_menu_data_version
 from nollesystemet.managers import UserProfileManager
 from .misc import validate_no_emoji, IntegerChoices
 
@@ -91,6 +95,11 @@ class UserProfile(auth_models.UserProfile):
         verbose_name = 'Användarprofil'
         verbose_name_plural = 'Användarprofiler'
 
+    # What the properties need to be read without querying, see DownloadView.get_accessor_dependencies
+    PROPERTY_DEPENDENCIES = {
+        'email': {'select_related': ['auth_user']},
+    }
+
     @property
     def type(self):
         return UserProfile.UserType(self.user_type).label
@@ -100,8 +109,8 @@ class UserProfile(auth_models.UserProfile):
         return UserProfile.Program(self.program).label
 
     def has_perm(self, codename):
-        """ :return Boolean indicating if user has specified permission. """
-        return self.auth_user.has_perm(codename)
+        """ :return Boolean indicating if user has specified permission. Answered from the permission snapshot. """
+        return get_permission_snapshot(self.auth_user).has_perm(codename)
 
     @staticmethod
     def can_create(observing_user):
@@ -147,18 +156,16 @@ class UserProfile(auth_models.UserProfile):
     @staticmethod
     def can_see_some_user(observing_user):
         """ :return Boolean indicating if observing_user has the right to see the profile of some user. """
-        # If can see more than one user. Larger than 1 because all users can see their own profile
-        return len(
-            [True for user in UserProfile.objects.all() if user.can_see(observing_user)]
-        ) > min(1, UserProfile.objects.count() - 1)
+        # If can see some other user. All users can see their own profile, which is enough if they are alone.
+        other_users = UserProfile.objects.exclude(pk=observing_user.pk)
+        return other_users.visible_to(observing_user).exists() or not other_users.exists()
 
     @staticmethod
     def can_edit_some_user(observing_user):
         """ :return Boolean indicating if observing_user has the right to edit the profile of some user. """
-        # If can edit more than one user. Larger than 1 because all users can edit their own profile
-        return len(
-            [True for user in UserProfile.objects.all() if user.can_edit(observing_user)]
-        ) > min(1, UserProfile.objects.count() - 1)
+        # If can edit some other user. All users can edit their own profile, which is enough if they are alone.
+        other_users = UserProfile.objects.exclude(pk=observing_user.pk)
+        return other_users.editable_by(observing_user).exists() or not other_users.exists()
 
     def is_responsible_forfadder(self, potential_forfadder):
         """ :return Boolean indicating if potential_forfadder is the forfadder of calling user. """
@@ -230,6 +237,117 @@ class UserProfile(auth_models.UserProfile):
 
         return user_profile
 
+    @staticmethod
+    def provision_users(users_info, chunk_size=500):
+        """
+        Creates or updates many users at once, like create_new_user and update_user does for one. All rows are
+        validated before anything is written. Rows with errors are skipped, the rest are written with bulk queries,
+        chunk_size users per transaction.
+        :param users_info: List of dicts of the arguments of create_new_user, e.g. the rows of a UserAdministrationForm.
+        :return Tuple of the list of created or updated users and a list of error messages of the skipped rows.
+        """
+        auth_user_model = apps.get_model(settings.AUTH_USER_MODEL)
+        usernames = [auth_user_model.normalize_username(user_info['username']) for user_info in users_info]
+        existing_auth_users = {
+            auth_user.username: auth_user
+            for auth_user in auth_user_model.objects.filter(username__in=usernames).select_related('profile')
+        }
+        username_by_email = {
+            email.lower(): username for email, username in auth_user_model.objects.values_list('email', 'username')
+        }
+
+        errors = []
+        to_create = []  # [(auth_user, user_profile), ...]
+        to_update = []
+        to_set_password = []  # [(auth_user, password), ...]
+        seen_usernames = set()
+        for row, (username, user_info) in enumerate(zip(usernames, users_info)):
+            user_info = dict(user_info)
+            user_info.pop('username')
+            email = user_info.pop('email')
+            password = user_info.pop('password', None)
+            if 'kth_id' in user_info and user_info['kth_id'] is None:
+                user_info.pop('kth_id')
+
+            auth_user = existing_auth_users.get(username)
+            is_new = auth_user is None
+            if is_new:
+                auth_user = auth_user_model(username=username)
+                user_profile = UserProfile(auth_user=auth_user)
+            else:
+                user_profile = auth_user.profile
+            auth_user.email = email
+            for field_name, field_value in user_info.items():
+                setattr(user_profile, field_name, field_value)
+
+            row_errors = []
+            # A repeated username refers to the user of an earlier row, so it is an update of that user
+            is_repeated = username in seen_usernames
+            if is_repeated:
+                row_errors.append("Användarnamnet förekommer flera gånger i filen.")
+            seen_usernames.add(username)
+            if username_by_email.get(email.lower(), username) != username:
+                row_errors.append("E-postadressen används redan av en annan användare.")
+            try:
+                auth_user.full_clean(exclude=['password'], validate_unique=False)
+            except ValidationError as e:
+                row_errors += e.messages
+            try:
+                # The nØllegrupp is already an object, so skip the query validating the foreign key
+                user_profile.full_clean(exclude=['auth_user', 'nolle_group'], validate_unique=False)
+            except ValidationError as e:
+                row_errors += e.messages
+
+            if row_errors:
+                errors.append("Fel vid %s av användare '%s' (på rad %d): %s" % (
+                    "skapande" if is_new and not is_repeated else "uppdaterande", user_profile.name, row + 1,
+                    ", ".join(row_errors)
+                ))
+            else:
+                # Only emails of rows that are written are taken, so that a skipped row does not reject later ones
+                username_by_email[email.lower()] = username
+                (to_create if is_new else to_update).append((auth_user, user_profile))
+                # Like update_user, only new users and users without a usable password get the password of the file
+                if is_new or not auth_user.has_usable_password():
+                    to_set_password.append((auth_user, password))
+
+        encoded_passwords = make_passwords([password or None for _, password in to_set_password])
+        for (auth_user, _), encoded_password in zip(to_set_password, encoded_passwords):
+            auth_user.password = encoded_password
+
+        profile_fields = sorted({field_name for user_info in users_info for field_name in user_info} -
+                                {'username', 'email', 'password'})
+        for start in range(0, max(len(to_create), len(to_update)), chunk_size):
+            created, updated = to_create[start:start + chunk_size], to_update[start:start + chunk_size]
+            with transaction.atomic():
+                if created:
+                    auth_user_model.objects.bulk_create([auth_user for auth_user, _ in created])
+                    # Not all databases return the primary keys of bulk created rows
+                    auth_user_pks = dict(auth_user_model.objects.filter(
+                        username__in=[auth_user.username for auth_user, _ in created]
+                    ).values_list('username', 'pk'))
+                    for auth_user, user_profile in created:
+                        auth_user.pk = auth_user_pks[auth_user.username]
+                        user_profile.auth_user = auth_user
+                    UserProfile.objects.bulk_create([user_profile for _, user_profile in created])
+                if updated:
+                    auth_user_model.objects.bulk_update([auth_user for auth_user, _ in updated], ['email', 'password'])
+                    UserProfile.objects.bulk_update([user_profile for _, user_profile in updated], profile_fields)
+
+        # Bulk queries send no signals, so do what the receivers of saved users would
+        if to_create or to_update:
+            from .happening import bump_happening_statistics_version
+            transaction.on_commit(bump_menu_data_version)
+            transaction.on_commit(bump_happening_statistics_version)
+            transaction.on_commit(lambda: bump_export_data_version(USERS_EXPORT_SCOPE))
+            if to_update:
+                registration_model = apps.get_model('nollesystemet.Registration')
+                registration_model.update_denormalized_prices(
+                    registration_model.objects.filter(user__in=[user_profile for _, user_profile in to_update])
+                )
+
+        return [user_profile for _, user_profile in to_create + to_update], errors
+
 
 @receiver(models.signals.post_delete, sender=UserProfile)
 def delete_auth_user(sender, instance, *args, **kwargs):
@@ -238,4 +356,35 @@ def delete_auth_user(sender, instance, *args, **kwargs):
         if instance.auth_user:
             instance.auth_user.delete()
     except:
-        pass
\ No newline at end of file
+        pass
+
+@receiver(models.signals.m2m_changed, sender=NolleGroup.forfadders.through)
+def invalidate_menus_forfadders(sender, action, *args, **kwargs):
+    """ Invalidates cached menus when the forfadders of a nolle group change. """
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        bump_menu_data_version()
+
+
+@receiver(models.signals.post_save, sender=UserProfile)
+@receiver(models.signals.post_delete, sender=UserProfile)
+@receiver(models.signals.post_delete, sender=NolleGroup)
+def invalidate_menus(sender, *args, **kwargs):
+    """ Invalidates cached menus when users or nolle groups change, since which users one can see depends on them. """
+    bump_menu_data_version()
+
+
+@receiver(models.signals.post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_exports_auth_user(sender, update_fields=None, **kwargs):
+    """ Invalidates the exports containing user data, unless only fields that are not exported were saved. """
+    if update_fields is not None and set(update_fields).isdisjoint(['username', 'email']):
+        return  # E.g. the last_login saved at every login
+    invalidate_user_exports(sender, **kwargs)
+
+
+@receiver(models.signals.post_save, sender=UserProfile)
+@receiver(models.signals.post_delete, sender=UserProfile)
+@receiver(models.signals.post_save, sender=NolleGroup)
+@receiver(models.signals.post_delete, sender=NolleGroup)
+def invalidate_user_exports(sender, *args, **kwargs):
+    """ Invalidates all exports containing user data once the transaction is committed. """
+    transaction.on_commit(lambda: bump_export_data_version(USERS_EXPORT_SCOPE))
@@ -0,0 +1,162 @@
+from collections import namedtuple, Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+import nollesystemet.models as models
+
+StatementPayment = namedtuple('StatementPayment', ['source', 'index', 'OCR', 'amount', 'row', 'content_hash'])
+ReconciledPayment = namedtuple('ReconciledPayment', ['payment', 'registration'])
+
+
+def _parse_amount(value):
+    if isinstance(value, str):
+        value = value.replace(',', '.').replace(' ', '')
+    return int(round(float(value)))
+
+
+def _parse_OCR(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def parse_swish_rows(rows):
+    """ Datastruktur: Datum, Avsändare, Mobilnummer, Belopp, Meddelande """
+    return _parse_rows(rows, models.PaymentTransaction.Source.SWISH, ocr_column=4, amount_column=3)
+
+
+def parse_bankgiro_rows(rows):
+    """ Datastruktur: Avsändare, Betalningsreferens, Bankgironummer, Belopp """
+    return _parse_rows(rows, models.PaymentTransaction.Source.BANKGIRO, ocr_column=1, amount_column=3)
+
+
+def _parse_rows(rows, source, ocr_column, amount_column):
+    """ :return List of StatementPayment, with amount None for rows that could not be read. """
+    payments = []
+    occurrences = Counter()
+    for i, row in enumerate(rows):
+        row_text = models.PaymentTransaction.row_to_text(row)
+        content_hash = models.PaymentTransaction.compute_hash(source, row_text, occurrences[row_text])
+        occurrences[row_text] += 1
+
+        try:
+            OCR = _parse_OCR(row[ocr_column])
+        except IndexError:
+            OCR = ''
+        try:
+            amount = _parse_amount(row[amount_column])
+        except (IndexError, TypeError, ValueError, OverflowError):
+            amount = None
+        payments.append(StatementPayment(source, i, OCR, amount, row_text, content_hash))
+    return payments
+
+
+class ReconciliationResult:
+    """
+    Outcome of reconcile_payments. Every payment ends up in exactly one of the lists:
+    already_imported: The row was matched or found already paid by an earlier reconciliation and was skipped.
+    matched: Registrations marked as paid by this reconciliation.
+    already_paid: Registrations that were already paid (or paid earlier in the same statement).
+    amount_mismatch: The amount differs from the pre paid price of the registration.
+    unknown_OCR: No registration has the OCR of the payment.
+    invalid: The row could not be read.
+    """
+
+    def __init__(self):
+        self.already_imported = []
+        self.matched = []
+        self.already_paid = []
+        self.amount_mismatch = []
+        self.unknown_OCR = []
+        self.invalid = []
+
+    def __len__(self):
+        return len(self.already_imported) + len(self.matched) + len(self.already_paid) + len(self.amount_mismatch) + \
+               len(self.unknown_OCR) + len(self.invalid)
+
+
+def reconcile_payments(payments, imported_by=None):
+    """
+    Matches payments against registrations by OCR and marks the matching registrations whose pre paid price equals the
+    paid amount as paid. Every payment is recorded as a PaymentTransaction. Payments already recorded with a final
+    status are skipped, the others are reconciled again and their PaymentTransaction updated, so that e.g. a corrected
+    registration is matched when the same statement is uploaded again.
+    All registrations are fetched with one query and updated with one query in a transaction.
+    :param payments: Iterable of StatementPayment.
+    :param imported_by: The UserProfile importing the payments.
+    :return: ReconciliationResult
+    """
+    payments = list(payments)
+    result = ReconciliationResult()
+    statuses = models.PaymentTransaction.Status
+
+    with transaction.atomic():
+        imported_transactions = {
+            imported_transaction.content_hash: imported_transaction for imported_transaction in
+            models.PaymentTransaction.objects.select_for_update().filter(
+                content_hash__in=[payment.content_hash for payment in payments]
+            )
+        }
+
+        new_payments = []
+        for payment in payments:
+            imported_transaction = imported_transactions.get(payment.content_hash)
+            if imported_transaction is not None and \
+                    imported_transaction.status in models.PaymentTransaction.FINAL_STATUSES:
+                result.already_imported.append(ReconciledPayment(payment, None))
+            else:
+                new_payments.append(payment)
+
+        registrations = {
+            registration.OCR: registration for registration in
+            models.Registration.objects.filter(OCR__in={
+                payment.OCR for payment in new_payments if models.Registration.is_valid_OCR(payment.OCR)
+            })
+                .select_related('user', 'happening').with_prices()
+        }
+
+        transactions = []
+        updated_transactions = []
+        for payment in new_payments:
+            registration = registrations.get(payment.OCR) if payment.amount is not None else None
+            if payment.amount is None:
+                result.invalid.append(ReconciledPayment(payment, None))
+                status = statuses.INVALID
+            elif registration is None:
+                result.unknown_OCR.append(ReconciledPayment(payment, None))
+                status = statuses.UNKNOWN_OCR
+            elif registration.annotated_pre_paid_price != payment.amount:
+                result.amount_mismatch.append(ReconciledPayment(payment, registration))
+                status = statuses.AMOUNT_MISMATCH
+            elif registration.paid:
+                result.already_paid.append(ReconciledPayment(payment, registration))
+                status = statuses.ALREADY_PAID
+            else:
+                registration.paid = True
+                result.matched.append(ReconciledPayment(payment, registration))
+                status = statuses.MATCHED
+
+            imported_transaction = imported_transactions.get(payment.content_hash)
+            if imported_transaction is None:
+                transactions.append(models.PaymentTransaction(
+                    source=payment.source, content_hash=payment.content_hash, row=payment.row, OCR=payment.OCR[:100],
+                    amount=payment.amount, status=status, registration=registration, imported_by=imported_by
+                ))
+            else:
+                imported_transaction.status = status
+                imported_transaction.registration = registration
+                imported_transaction.imported_by = imported_by
+                updated_transactions.append(imported_transaction)
+
+        if result.matched:
+            models.Registration.objects.filter(
+                pk__in=[reconciled.registration.pk for reconciled in result.matched]
+            ).update(paid=True, updated_at=timezone.now())
+            models.Happening.update_counters({reconciled.registration.happening_id for reconciled in result.matched})
+
+        models.PaymentTransaction.objects.bulk_update(updated_transactions, ['status', 'registration', 'imported_by'])
+        # Conflicts only arise if the same rows are imported concurrently, in which case the other import records them
+        models.PaymentTransaction.objects.bulk_create(transactions, ignore_conflicts=True)
+
+    return result
@@ -6,6 +6,7 @@ import nollesystemet.views as views
 from nollesystemet.api_views import user as api_views_user
 from nollesystemet.api_views import registration as api_views_registration
 from nollesystemet.api_views import campussafari as api_views_campussafari
+from nollesystemet.api_views import happening as api_views_happening
 
 login_urls = ([
     path('', views.LoginViewFohseriet.as_view(), name='index'),
@@ -50,6 +51,7 @@ api_urls = ([
     path('registrations', api_views_registration.RegistrationList.as_view()),
     path('registrations/<int:pk>', api_views_registration.update_registration),
     path('registrations/<int:pk>/confirm', api_views_registration.confirm_registration),
+    path('happenings/<int:pk>/statistics', api_views_happening.get_happening_statistics),
     path('campussafari/<int:group_pk>/check-side-quest/<int:side_pk>', api_views_campussafari.check_side_quest),
     path('campussafari/<int:group_pk>/set-station-points/<int:station_pk>', api_views_campussafari.set_station_points)
 ], 'api')
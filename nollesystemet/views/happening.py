@@ -8,7 +8,9 @@ from django.views.generic import UpdateView, ListView, FormView, TemplateView
 
 import nollesystemet.models as models
 import nollesystemet.forms as forms
+import nollesystemet.exports as exports
 import nollesystemet.mixins as mixins
+import nollesystemet.payments as payments
 from .misc import DownloadView, ModifiableModelFormView
 from ..forms import HappeningPaymentUploadForm
 
@@ -25,28 +27,19 @@ class HappeningListViewFadderiet(mixins.FadderietMixin, ListView):
     site_texts = ["intro", "betalningsinfo"]
 
     def get_queryset(self):
-        self.queryset = models.Happening.objects.all()
+        self.queryset = models.Happening.objects.visible_to(self.request.user.profile)\
+                                                .with_user_info(self.request.user.profile)
         querryset = super().get_queryset()
         q_set = []
         for happening in querryset:
-            if happening.is_visible_to(self.request.user.profile):
-                happening_dict = {
-                    'happening': happening,
-                    'can_register': happening.can_register(self.request.user.profile),
-                    'is_registered': happening.is_registered(self.request.user.profile),
-                }
-                try:
-                    reg = models.Registration.objects.get(happening=happening, user=self.request.user.profile)
-                except models.Registration.DoesNotExist:
-                    happening_dict['base_price'] = happening.get_baseprice(
-                        models.UserProfile.UserType(self.request.user.profile.user_type)
-                    )
-                    happening_dict['registration'] = None
-                else:
-                    happening_dict['base_price'] = None
-                    happening_dict['registration'] = reg
-
-                q_set.append(happening_dict)
+            registration = happening.user_registrations[0] if happening.user_registrations else None
+            q_set.append({
+                'happening': happening,
+                'can_register': happening.is_open_for_registration(),
+                'is_registered': registration is not None,
+                'base_price': happening.user_base_price if registration is None else None,
+                'registration': registration,
+            })
 
         return q_set
 
@@ -63,15 +56,14 @@ class HappeningListViewFohseriet(mixins.FohserietMixin, ListView):
                self.request.user.profile.has_perm('nollesystemet.edit_happening')
 
     def get_queryset(self):
-        self.queryset = models.Happening.objects.all()
+        self.queryset = models.Happening.objects.editable_by(self.request.user.profile)
         querryset = super().get_queryset()
         return [{
             'happening': happening,
-            'can_edit': happening.can_edit(self.request.user.profile),
-            'can_see_registered': happening.can_see_registered(self.request.user.profile),
+            'can_edit': True,
+            'can_see_registered': True,  # Implied by can_edit
         }
             for happening in querryset
-            if happening.can_edit(self.request.user.profile)
         ]
 
     def get_context_data(self, **kwargs):
@@ -93,94 +85,33 @@ class HappeningPaymentsView(mixins.FohserietMixin, FormView):
         return models.Happening.can_handle_payments(self.request.user.profile)
 
     def form_valid(self, form):
-        new_payments = 0
-        new_errors = 0
-        error_indexes = []
-        return_data = []
-
+        statement_payments = []
         if form.cleaned_data['swish']:
-            return_data, new_payments, new_errors, error_indexes = self.handle_swish(form.cleaned_data['swish'])
-
+            statement_payments += payments.parse_swish_rows(form.cleaned_data['swish'])
         if form.cleaned_data['bankgiro']:
-            return_data, new_payments, new_errors, error_indexes = self.handle_bankgiro(form.cleaned_data['bankgiro'])
+            statement_payments += payments.parse_bankgiro_rows(form.cleaned_data['bankgiro'])
 
-        error_payments = []
-        for error_index in error_indexes:
-            error_payments.append({
-                'OCR': return_data[error_index][4],
-                'info': return_data[error_index][-1]
-            })
+        result = payments.reconcile_payments(statement_payments, imported_by=self.request.user.profile)
+
+        error_payments = [{
+            'OCR': reconciled.payment.OCR,
+            'info': "%s betalade %d,00, skulle betala %d,00" % (reconciled.registration.user.name,
+                                                                reconciled.payment.amount,
+                                                                reconciled.registration.annotated_pre_paid_price)
+        } for reconciled in result.amount_mismatch]
 
         return self.render_to_response(
             self.get_context_data(
                 form=form,
-                success_message="Registrerade %d nya betalningar." % new_payments,
-                error_message="Registrerade %d nya felaktiga betalningar." % new_errors if new_errors > 0 else None,
-                error_payments=error_payments
+                success_message="Registrerade %d nya betalningar." % len(result.matched) +
+                                (" Hoppade över %d redan inlästa rader." % len(result.already_imported)
+                                 if result.already_imported else ""),
+                error_message="Registrerade %d nya felaktiga betalningar." % len(error_payments) if error_payments else None,
+                error_payments=error_payments,
+                reconciliation=result
             )
         )
 
-    @staticmethod
-    def handle_swish(swish_data):
-        """ Datastruktur: Datum, Avsändare, Mobilnummer, Belopp, Meddelande"""
-        new_payments = 0
-        new_errors = 0
-        error_indexes = []
-
-        for i, entry_data in enumerate(swish_data):
-            try:
-                OCR_match = models.Registration.objects.get(OCR=entry_data[4].strip())
-
-                paid_price = int(round(float(entry_data[3].replace(',', '.'))))
-                if OCR_match.pre_paid_price == paid_price:
-                    if not OCR_match.paid:
-                        OCR_match.paid = True
-                        OCR_match.save()
-                        new_payments += 1
-
-                    swish_data[i][4] = OCR_match.happening.name
-
-                else:
-                    new_errors += 1
-                    swish_data[i].append("%s betalade %d,00, skulle betala %d,00" % (OCR_match.user.name, paid_price, OCR_match.pre_paid_price))
-                    error_indexes.append(i)
-
-            except models.Registration.DoesNotExist:
-                pass
-
-        return swish_data, new_payments, new_errors, error_indexes
-
-    @staticmethod
-    def handle_bankgiro(bankgiro_data):
-        """ Datastruktur: Avsändare, Betalningsreferens, Bankgironummer, Belopp"""
-
-        new_payments = 0
-        new_errors = 0
-        error_indexes = []
-
-        for i, entry_data in enumerate(bankgiro_data):
-            try:
-                OCR_match = models.Registration.objects.get(OCR=entry_data[1].strip())
-
-                paid_price = int(round(float(entry_data[3])))
-                if OCR_match.pre_paid_price == paid_price:
-                    if not OCR_match.paid:
-                        OCR_match.paid = True
-                        OCR_match.save()
-                        new_payments += 1
-
-                    bankgiro_data[i][1] = OCR_match.happening.name
-
-                else:
-                    new_errors += 1
-                    bankgiro_data[i][1] = "FEL BELOPP! (%s)" % OCR_match.happening.name
-                    error_indexes.append(i)
-
-            except models.Registration.DoesNotExist:
-                pass
-
-        return bankgiro_data, new_payments, new_errors, error_indexes
-
 
 class HappeningRegisteredListView(mixins.FohserietMixin, ListView):
     model = models.Registration
@@ -209,26 +140,50 @@ class HappeningRegisteredListView(mixins.FohserietMixin, ListView):
         return self.happening.can_edit(self.request.user.profile)
 
     def get_queryset(self):
-        self.queryset = models.Registration.objects.filter(happening=models.Happening.objects.get(pk=self.kwargs['pk']))
+        """
+        :return List of read-only presentations of the registrations (see get_registration_details), built from one
+        price annotated queryset. No forms are built, editing is done in RegistrationUpdateView.
+        """
+        self.queryset = models.Registration.objects.filter(happening=self.happening).with_prices()\
+                                                   .select_related('user__auth_user', 'user__nolle_group', 'drink_option')\
+                                                   .prefetch_related('extra_option')
         querryset = super().get_queryset()
+
+        observing_user = self.request.user.profile
+        registrations = models.Registration.objects.filter(happening=self.happening)
+        visible_pks = set(registrations.visible_to(observing_user).values_list('pk', flat=True))
+        editable_pks = set(registrations.editable_by(observing_user).values_list('pk', flat=True))
+        drink_options = list(self.happening.drinkoption_set.all().order_by('price'))
+        extra_options = list(self.happening.extraoption_set.all().order_by('price'))
+
         return [{
             'registration': registration,
-            'can_edit': registration.can_edit(self.request.user.profile),
-            'can_see': registration.can_see(self.request.user.profile),
-            'form': forms.RegistrationForm(instance=registration, editable=False)
+            'can_edit': registration.pk in editable_pks,
+            'can_see': registration.pk in visible_pks,
+            'details': self.get_registration_details(registration, drink_options, extra_options),
         } for registration in querryset]
 
+    def get_registration_details(self, registration, drink_options, extra_options):
+        """ :return Dict of the fields of the registration form, as shown in the read-only registration template. """
+        selected_extra_option_pks = {extra_option.pk for extra_option in registration.extra_option.all()}
+        return {
+            'food_preference': registration.food_preference if self.happening.food else None,
+            'drink_options': [{
+                'label': str(drink_option),
+                'selected': drink_option.pk == registration.drink_option_id,
+            } for drink_option in drink_options],
+            'extra_options': [{
+                'label': str(extra_option),
+                'selected': extra_option.pk in selected_extra_option_pks,
+            } for extra_option in extra_options],
+            'other': registration.other,
+        }
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update({
-            'happening': models.Happening.objects.get(pk=self.kwargs['pk']),
-            'num_of_attendees_per_group': [
-                {
-                    'group': group.name,
-                    'count': models.Registration.objects.filter(happening_id=self.kwargs['pk'], user__nolle_group_id=group.id).count()
-                }
-                for group in models.NolleGroup.objects.all()
-            ]
+            'happening': self.happening,
+            'statistics': self.happening.get_cached_statistics(),
         })
         return context
 
@@ -270,6 +225,13 @@ class HappeningDownloadView(mixins.FohserietMixin, DownloadView):
     def get_queryset(self):
         return models.Registration.objects.filter(happening=self.happening)
 
+    def get_export_name(self):
+        return 'anmalda_%d' % self.happening.pk
+
+    def get_export_data_version(self):
+        return exports.get_export_data_version(exports.USERS_EXPORT_SCOPE,
+                                               exports.HAPPENING_EXPORT_SCOPE % self.happening.pk)
+
 
 class HappeningUpdateView(mixins.FohserietMixin, ModifiableModelFormView):
     model = models.Happening
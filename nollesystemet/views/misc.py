@@ -1,23 +1,32 @@
-import collections
-import csv
+import logging
+import operator
 import urllib
+from concurrent.futures import TimeoutError
 from abc import abstractmethod
 from typing import Any, Callable
 
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.db import connection
+from django.db.models import QuerySet, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
 from django.template import RequestContext
 from django.template.response import TemplateResponse
 from django.urls import reverse, reverse_lazy
-from django.http import QueryDict, HttpResponseRedirect, HttpResponse, HttpResponseServerError
+from django.utils.text import slugify
+from django.http import QueryDict, HttpResponseRedirect, HttpResponse, HttpResponseServerError, HttpResponseBadRequest, \
+    FileResponse
 from django.views import View
 from django.views.generic import TemplateView, UpdateView, FormView, ListView
 from django.views.generic.edit import ProcessFormView, BaseFormView, BaseUpdateView, FormMixin
 
 import nollesystemet.mixins as mixins
 import nollesystemet.forms as forms
+import nollesystemet.exports as exports
 from nollesystemet.models import NolleGroup
 
+logger = logging.getLogger(__name__)
+
 
 class FadderietMenuView(mixins.FadderietMixin, TemplateView):
     pass
@@ -284,9 +293,25 @@ class MultipleObjectsUpdateView(UpdateView):
 
 
 class DownloadView(View):
+    """
+    View exporting the items of get_queryset as a file. The columns are given by csv_data_structure, a list of
+    dicts with a 'title' and either an 'accessor' (dotted attribute path) or a 'function' (called with the item and
+    'args'). The file format is chosen by the GET parameter 'format', one of the keys of export_writers (default csv).
+
+    Views returning a data version from get_export_data_version have their exports generated by a background job
+    into settings.EXPORT_ROOT, and served from there until the data version changes.
+
+    The select_related and prefetch_related lookups needed by the accessors are added to the queryset automatically,
+    including those the models declare for their properties in PROPERTY_DEPENDENCIES (see get_accessor_dependencies).
+    Function columns can list their lookups under 'select_related' and 'prefetch_related'.
+    """
     csv_data_structure: Any = []
     file_name = None
     delimiter = ','
+    chunk_size = 2000
+    export_writers = exports.EXPORT_WRITERS
+    default_export_format = 'csv'
+    export_retry_after = 3
 
     def get_file_name(self):
         raise NotImplementedError()
@@ -294,63 +319,178 @@ class DownloadView(View):
     def get_queryset(self):
         raise NotImplementedError()
 
-    def get(self, request, *args, **kwargs):
-        if self.file_name is None:
-            self.file_name = self.get_file_name()
+    @staticmethod
+    def compile_column(column):
+        """ :return Callable taking an item and returning the raw value of column. """
+        if 'accessor' in column:
+            return operator.attrgetter(column['accessor'])
+        elif 'function' in column:
+            fn: Callable = column['function']
+            fn_args = column.get('args', [])
+            return lambda item: fn(item, *fn_args)
+        else:
+            raise SyntaxError("No valid way of obtaining data was presented. Either specify an 'accessor' path or a 'function' to run to obtain data." )
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="' + self.file_name + '.csv"'
-        writer = csv.writer(response, delimiter=self.delimiter, lineterminator='\n')
-
-        # Write column titles
-        writer.writerow([column['title'] for column in self.csv_data_structure])
-
-        # Write registration data
-        queryset = self.get_queryset()
-        row_data = []
-        for item in queryset:
-            column_data = []
-
-            for column in self.csv_data_structure:
-                value = None
-                if 'accessor' in column:
-                    accessor_path = column['accessor']
-                    current_node = item
-                    while '.' in accessor_path:
-                        index = accessor_path.find('.')
-                        next_accessor = accessor_path[:index]
-                        accessor_path = accessor_path[index+1:]
-
-                        current_node = current_node.__getattribute__(next_accessor)
-                    value = current_node.__getattribute__(accessor_path)
-
-                elif 'function' in column:
-                    fn: Callable = column['function']
-                    fn_args = column.get('args', [])
-                    value = fn(item, *fn_args)
+    def iterate_queryset(self, queryset):
+        """
+        Iterates over queryset without caching the results, chunk_size items at a time. QuerySet.iterator() ignores
+        prefetch_related, so the prefetching is done for every chunk.
+        """
+        if not isinstance(queryset, QuerySet):
+            yield from queryset
+            return
+
+        prefetch_lookups = queryset._prefetch_related_lookups
+        chunk = []
+        for item in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                prefetch_related_objects(chunk, *prefetch_lookups)
+                yield from chunk
+                chunk = []
+        prefetch_related_objects(chunk, *prefetch_lookups)
+        yield from chunk
+
+    @staticmethod
+    def get_accessor_dependencies(model, accessor_path):
+        """
+        Follows the dotted accessor_path through the fields of model.
+        :return Tuple (select_related, prefetch_related, queryset_methods) of what is needed to access the path
+        without querying per item. Relations are select_related until a to-many relation is passed, after which they
+        are prefetched. A property is looked up in PROPERTY_DEPENDENCIES of its model, a dict from property name to a
+        dict with any of the keys 'select_related', 'prefetch_related' and 'queryset_methods' (names of methods of the
+        queryset of the model, e.g. annotating values the property uses). The path ends at the first attribute that is
+        neither a relation nor a property with declared dependencies.
+        """
+        select_related, prefetch_related, queryset_methods = set(), set(), []
+        lookup, prefetching = [], False
+        for name in accessor_path.split('.'):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                dependencies = getattr(model, 'PROPERTY_DEPENDENCIES', {}).get(name, {})
+                select_related.update(LOOKUP_SEP.join(lookup + [related_lookup])
+                                      for related_lookup in dependencies.get('select_related', []))
+                prefetch_related.update(LOOKUP_SEP.join(lookup + [related_lookup])
+                                        for related_lookup in dependencies.get('prefetch_related', []))
+                if not lookup:  # Only the queryset of the root model can be altered
+                    queryset_methods += dependencies.get('queryset_methods', [])
+                break
+
+            if not field.is_relation:
+                break
+            lookup.append(name)
+            prefetching = prefetching or field.many_to_many or field.one_to_many
+            (prefetch_related if prefetching else select_related).add(LOOKUP_SEP.join(lookup))
+            model = field.related_model
+        return select_related, prefetch_related, queryset_methods
+
+    def optimize_queryset(self, queryset):
+        """ :return queryset with the lookups and queryset methods needed by csv_data_structure applied. """
+        if not isinstance(queryset, QuerySet):
+            return queryset
+
+        select_related, prefetch_related, queryset_methods = set(), set(), []
+        for column in self.csv_data_structure:
+            select_related.update(column.get('select_related', []))
+            prefetch_related.update(column.get('prefetch_related', []))
+            if 'accessor' in column:
+                column_dependencies = self.get_accessor_dependencies(queryset.model, column['accessor'])
+                select_related.update(column_dependencies[0])
+                prefetch_related.update(column_dependencies[1])
+                queryset_methods += [method for method in column_dependencies[2] if method not in queryset_methods]
+
+        for method in queryset_methods:
+            queryset = getattr(queryset, method)()
+        if select_related:
+            queryset = queryset.select_related(*sorted(select_related))
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*sorted(prefetch_related))
+        return queryset
+
+    def get_titles(self):
+        return [column['title'] for column in self.csv_data_structure]
+
+    def get_rows(self):
+        """ :return Generator of the rows of the export, as lists of the raw column values. """
+        columns = [self.compile_column(column) for column in self.csv_data_structure]
+        queryset = self.optimize_queryset(self.get_queryset())
+
+        def rows():
+            for item in self.iterate_queryset(queryset):
+                yield [column(item) for column in columns]
+        return rows()
+
+    def get_export_writer(self, export_format):
+        """ :return The ExportWriter of export_format, or None if the format is not supported. """
+        if export_format not in self.export_writers:
+            return None
+        if export_format == 'csv':
+            return self.export_writers[export_format](delimiter=self.delimiter)
+        return self.export_writers[export_format]()
 
-                else:
-                    raise SyntaxError("No valid way of obtaining data was presented. Either specify an 'accessor' path or a 'function' to run to obtain data." )
+    def count_queries(self, rows):
+        """ Passes on rows, logging the number of database queries used to produce them. """
+        num_of_queries = 0
 
-                if value is None or isinstance(value, str):
-                    pass
-                elif isinstance(value, collections.abc.Iterable):
-                    value = ', '.join([str(v) for v in value])
-                elif isinstance(value, object):
-                    value = str(value)
-                elif value is None:
-                    value = ""
+        def count_query(execute, sql, params, many, context):
+            nonlocal num_of_queries
+            num_of_queries += 1
+            return execute(sql, params, many, context)
 
-                # Remove newlines
-                if isinstance(value, str):
-                    value = value.replace('\n', ' ').replace('\r', '')
-                column_data.append(value)
+        with connection.execute_wrapper(count_query):
+            yield from rows
+        logger.debug("%s exported %s with %d queries.", self.__class__.__name__, self.file_name, num_of_queries)
+
+    def get_export_data_version(self):
+        """
+        :return Version of the exported data (see exports.get_export_data_version), or None if the export should not
+        be cached.
+        """
+        return None
 
-            row_data.append(column_data)
+    def get_export_name(self):
+        """ :return Name identifying the export among the cached exports. """
+        return slugify(self.file_name)
 
-        writer.writerows(row_data)
+    def get_export_pending_response(self):
+        response = HttpResponse('<html><head><meta http-equiv="refresh" content="%d"></head>'
+                                '<body>Filen skapas, sidan laddas om när den är klar.</body></html>'
+                                % self.export_retry_after, status=202)
+        response['Retry-After'] = self.export_retry_after
         return response
 
+    def get(self, request, *args, **kwargs):
+        if self.file_name is None:
+            self.file_name = self.get_file_name()
+
+        export_writer = self.get_export_writer(request.GET.get('format', self.default_export_format))
+        if export_writer is None:
+            return HttpResponseBadRequest("Formatet stöds inte. Välj ett av: %s." % ', '.join(self.export_writers))
+
+        data_version = self.get_export_data_version()
+        if data_version is None:
+            rows = self.get_rows()
+            if settings.DEBUG:
+                rows = self.count_queries(rows)
+            return export_writer.get_response(self.get_titles(), rows, self.file_name)
+
+        titles = self.get_titles()
+        path = exports.get_export_path(self.get_export_name(), data_version, titles, export_writer)
+        job = exports.request_export(path, export_writer, lambda: (titles, self.get_rows()))
+        if job is not None:
+            try:
+                job.result(timeout=getattr(settings, 'EXPORT_WAIT_TIMEOUT', 10))
+            except TimeoutError:
+                return self.get_export_pending_response()
+
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:  # Replaced by a newer version since checked
+            return self.get_export_pending_response()
+        return FileResponse(file, as_attachment=True, filename=export_writer.get_file_name(self.file_name),
+                            content_type=export_writer.content_type)
+
 
 class ObjectsAdministrationListView(FormMixin, ListView):
 
@@ -1,3 +1,4 @@
+import collections
 import json
 from typing import Any
 
@@ -5,6 +6,7 @@ from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy, reverse
 from django.views.generic import TemplateView, FormView, UpdateView
 
+import nollesystemet.exports as exports
 import nollesystemet.mixins as mixins
 import nollesystemet.models as models
 from nollesystemet.forms import NolleFormBaseForm, NolleFormAdministrationForm, ValidationError
@@ -102,41 +104,41 @@ class NolleFormDownloadView(mixins.FohserietMixin, DownloadView):
             return ""
 
     @staticmethod
-    def get_dynamic_value(answer: models.NolleFormAnswer, dynamic_question):
-        try:
-            ans = models.DynamicNolleFormQuestionAnswer.objects.filter(
-                question=dynamic_question,
-                nolleformanswer__user=answer.user
-            )
-        except models.DynamicNolleFormQuestionAnswer.DoesNotExist:
-            return ""
-        else:
-            if dynamic_question.question_type == models.DynamicNolleFormQuestion.QuestionType.TEXT:
-                if ans.count() == 1:
-                    return ans[0].value
-                else:
-                    return ""
-            elif dynamic_question.question_type == models.DynamicNolleFormQuestion.QuestionType.RADIO:
-                if ans.count() == 1:
-                    if ans[0].group:
-                        return ans[0].group
-                    else:
-                        return ans[0].value
-                else:
-                    return ""
+    def get_dynamic_answers():
+        """
+        Reads all dynamic answers with one query and pivots them.
+        :return Dict from (NolleFormAnswer pk, DynamicNolleFormQuestion pk) to list of (value, group) of the answers.
+        """
+        dynamic_answers = collections.defaultdict(list)
+        for answer_pk, question_pk, value, group in models.NolleFormAnswer.dynamic_answers.through.objects.values_list(
+                'nolleformanswer', 'dynamicnolleformquestionanswer__question', 'dynamicnolleformquestionanswer__value',
+                'dynamicnolleformquestionanswer__group').order_by('dynamicnolleformquestionanswer'):
+            dynamic_answers[(answer_pk, question_pk)].append((value, group))
+        return dynamic_answers
+
+    def get_dynamic_value(self, answer: models.NolleFormAnswer, dynamic_question):
+        ans = self.dynamic_answers.get((answer.pk, dynamic_question.pk), [])
+        if dynamic_question.question_type == models.DynamicNolleFormQuestion.QuestionType.TEXT:
+            if len(ans) == 1:
+                return ans[0][0]
+            else:
+                return ""
+        elif dynamic_question.question_type == models.DynamicNolleFormQuestion.QuestionType.RADIO:
+            if len(ans) == 1:
+                value, group = ans[0]
+                return group if group else value
             else:
-                try:
-                    return ", ".join([a.group if a.group else a.value for a in ans.all()])
-                except:
-                    return ""
+                return ""
+        else:
+            return ", ".join([group if group else value for value, group in ans])
 
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         self.empty_form = NolleFormBaseForm()
-        self.non_dynamic_fields = [val for val in NolleFormBaseForm().fields if not val[:2] == "q_"]
+        self.non_dynamic_fields = [val for val in self.empty_form.fields if not val[:2] == "q_"]
         self.csv_data_structure: Any = [
             {'title': 'username', 'accessor': 'user.auth_user.username'},
-            {'title': 'program', 'function': self.get_user_program}
+            {'title': 'program', 'function': self.get_user_program, 'select_related': ['user']}
         ]
         self.csv_data_structure += [
             {
@@ -154,4 +156,11 @@ class NolleFormDownloadView(mixins.FohserietMixin, DownloadView):
         ]
 
     def get_queryset(self):
+        self.dynamic_answers = self.get_dynamic_answers()
         return models.NolleFormAnswer.objects.all()
+
+    def get_export_name(self):
+        return 'nolleenkaten'
+
+    def get_export_data_version(self):
+        return exports.get_export_data_version(exports.USERS_EXPORT_SCOPE, exports.NOLLE_FORM_EXPORT_SCOPE)
@@ -1,13 +1,10 @@
-import sys
-
 from django.apps import apps
 from django.conf import settings
-from django.core.exceptions import ValidationError
+from django.db.models import Count, Exists, OuterRef, Q
 from django.http import HttpResponseRedirect, HttpRequest
 from django.urls import reverse_lazy, reverse
 from django.views.generic import ListView
 
-import authentication.models as auth_models
 import nollesystemet.models as models
 import nollesystemet.forms as forms
 import nollesystemet.mixins as mixins
@@ -45,7 +42,8 @@ class UsersListView(mixins.FohserietMixin, ObjectsAdministrationListView):
     model = models.UserProfile
     template_name = 'fohseriet/anvandare/index.html'
 
-    ordering = 'first_name'
+    ordering = ['first_name', 'last_name', 'pk']
+    paginate_by = 100
 
     form_class = forms.UserAdministrationForm
 
@@ -61,44 +59,39 @@ class UsersListView(mixins.FohserietMixin, ObjectsAdministrationListView):
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            self.queryset = models.UserProfile.objects.all()
-            querryset = super().get_queryset()
-            querryset = [user for user in querryset if user.can_see(self.request.user.profile)]
-            return [{
-                'user': user,
-                'can_see': user.can_see_registrations(self.request.user.profile),
-                'can_see_registrations': user.can_see_registrations(self.request.user.profile),
-                'can_see_nolleForm': user.can_see_nolleForm_answer(self.request.user.profile),
-            } for user in querryset]
+            self.queryset = models.UserProfile.objects.visible_to(self.request.user.profile) \
+                .select_related('nolle_group') \
+                .annotate(has_nolleForm_answer=Exists(models.NolleFormAnswer.objects.filter(user=OuterRef('pk'))))
+            return super().get_queryset()
         else:
-            return []
+            return models.UserProfile.objects.none()
 
     def get_context_data(self, **kwargs):
         if not self.request.user.profile.has_perm('nollesystemet.edit_users'):
             kwargs['form'] = None
         context = super().get_context_data(**kwargs)
+
+        # The queryset only contains users the observer can see, which is enough to see their registrations as well
+        context['object_list'] = [{
+            'user': user,
+            'can_see': True,
+            'can_see_registrations': True,
+            'can_see_nolleForm': user.has_nolleForm_answer,
+        } for user in context['object_list']]
+
+        num_of_users = models.UserProfile.objects.aggregate(total=Count('pk'), **{
+            'type_%d' % user_type: Count('pk', filter=Q(user_type=user_type)) for user_type in models.UserProfile.UserType
+        })
         context.update({
             'num_of_users_per_type': [
-                (user_type.label, models.UserProfile.objects.filter(user_type=user_type).count())
-                for user_type in models.UserProfile.UserType
+                (user_type.label, num_of_users['type_%d' % user_type]) for user_type in models.UserProfile.UserType
             ],
-            'num_of_users_total': models.UserProfile.objects.all().count()
+            'num_of_users_total': num_of_users['total']
         })
         return context
 
     def handle_uploaded_file(self, file_data):
-        errors = []
-        users = []
-
-        all_usernames = auth_models.AuthUser.objects.all().values_list('username', flat=True)
-        for user_info in file_data:
-            if user_info['username'] in all_usernames:
-                user, errors = UsersListView._update_user(user_info, errors)
-            else:
-                user, errors = UsersListView._create_user(user_info, errors)
-
-            if user:
-                users.append(user)
+        users, errors = models.UserProfile.provision_users(file_data)
 
         self.file_upload_information = ""
         self.file_upload_success = True
@@ -111,36 +104,6 @@ class UsersListView(mixins.FohserietMixin, ObjectsAdministrationListView):
                 ", ".join([user.name for user in users])
             )
 
-    @staticmethod
-    def _update_user(user_info, errors):
-        try:
-
-            return models.UserProfile.update_user(**user_info), errors
-        except ValidationError as e:
-            errors.append("Fel vid uppdaterande av användare '%s': %s" % (
-                user_info['first_name'] + ' ' + user_info['last_name'], ", ".join(e.messages)
-            ))
-        except:
-            errors.append("Fel vid uppdaterande av användare '%s': %s" % (
-                user_info['first_name'] + ' ' + user_info['last_name'], "Unexpected error:" + str(sys.exc_info()[0])
-            ))
-
-        return None, errors
-
-    @staticmethod
-    def _create_user(user_info, errors):
-        try:
-            return models.UserProfile.create_new_user(**user_info), errors
-        except ValidationError as e:
-            errors.append("Fel vid skapande av användare '%s': %s" % (
-                user_info['first_name'] + ' ' + user_info['last_name'], ", ".join(e.messages)
-            ))
-        except:
-            errors.append("Fel vid skapande av användare '%s': %s" % (
-                user_info['first_name'] + ' ' + user_info['last_name'], "Unexpected error:" + str(sys.exc_info()[0])
-            ))
-
-        return None, errors
 
 class UserUpdateView(mixins.FohserietMixin, ModifiableModelFormView):
     model = models.UserProfile
@@ -89,6 +89,7 @@ MIDDLEWARE = (
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'authentication.middleware.PermissionSnapshotMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware'
@@ -128,6 +129,37 @@ DATABASES = {
     }
 }
 
+# Cache shared by all worker processes, so that invalidation in one worker is seen by the others
+CACHE_ROOT_SETTINGS = file_settings.get('CACHE_ROOT') or 'cache'
+if os.path.isabs(CACHE_ROOT_SETTINGS):
+    CACHE_ROOT = CACHE_ROOT_SETTINGS
+else:
+    CACHE_ROOT = os.path.abspath(os.path.join(PROJECT_APP_ROOT, CACHE_ROOT_SETTINGS))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_ROOT,
+        'OPTIONS': {
+            # Room for the per user menus and the cached site contents, statistics and snapshots of a whole season.
+            # When full, a quarter of the entries is culled. Culled version counters restart above any earlier
+            # version (see authentication.utils.get_cache_version).
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 4,
+        },
+    }
+}
+
+# Generated exports (see nollesystemet.exports). They contain personal data, so they are kept outside PUBLIC_ROOT and
+# only served through the download views after the permission check.
+EXPORT_ROOT_SETTINGS = file_settings.get('EXPORT_ROOT') or 'exports'
+if os.path.isabs(EXPORT_ROOT_SETTINGS):
+    EXPORT_ROOT = EXPORT_ROOT_SETTINGS
+else:
+    EXPORT_ROOT = os.path.abspath(os.path.join(PROJECT_APP_ROOT, EXPORT_ROOT_SETTINGS))
+EXPORT_JOB_WORKERS = 2
+EXPORT_WAIT_TIMEOUT = 10  # Seconds a download request waits for its export before answering that it is pending
+
 # Internationalization
 LANGUAGE_CODE = 'sv'
 TIME_ZONE = 'Europe/Stockholm'
@@ -177,6 +209,10 @@ LOGIN_URL = reverse_lazy('fadderiet:logga-in:index')
 LOGIN_REDIRECT_URL = reverse_lazy('fadderiet:index')
 LOGOUT_REDIRECT_URL = reverse_lazy('fadderiet:index')
 
+# Keep permission snapshots in the session between requests (see authentication.middleware)
+PERMISSION_SNAPSHOT_IN_SESSION = True
+PERMISSION_SNAPSHOT_MAX_AGE = 60
+
 
 # Email setup
 email_settings = read_conf_json_settings(os.path.join(os.path.dirname(__file__), 'config_files/mail.json'))
@@ -205,6 +241,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 OCR_NUMBER_LOW = 100000
 OCR_NUMBER_HIGH = 999999
 OCR_NUMBER_NUM_DIGITS = 6
+# Make the last digit of new OCR numbers a check digit. Payments with OCR numbers without a valid check digit are then
+# rejected, so only change between seasons.
+OCR_CHECK_DIGIT = False
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [